@@ -1,46 +1,2221 @@
-from flask import Flask, render_template_string, request, redirect, url_for, session, send_file
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import (Flask, render_template, stream_template, request, redirect, url_for,
+                   session, send_file, g, abort, jsonify, Response, stream_with_context)
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
+from flask.sessions import SessionInterface, SessionMixin
+from jinja2 import ChoiceLoader, DictLoader, FileSystemBytecodeCache
+from werkzeug.utils import secure_filename
+from werkzeug.datastructures import CallbackDict
+from werkzeug.wsgi import ClosingIterator
+from openpyxl import Workbook
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+import brotli
+import numpy as np
 import pandas as pd
+import atexit
+import copy
+import fcntl
+import glob
+import hashlib
+import io
 import json
+import mimetypes
+import operator
 import os
-
-app = Flask(__name__)
+import pickle
+import queue
+import secrets
+import signal
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+
+app = Flask(__name__, static_folder=None)
 app.secret_key = 'supersecret'
+# Browsers leave the session cookie off cross-site POSTs
+app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
+
+# Prometheus metrics, served at /metrics. With PROMETHEUS_MULTIPROC_DIR set
+# (gunicorn.conf.py does) every process writes its samples there and the
+# endpoint aggregates them across workers.
+STAGE_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)
+REQUEST_SECONDS = Histogram('fleet_request_duration_seconds', 'Request latency, including streamed bodies',
+                            ['endpoint', 'method', 'status'], buckets=STAGE_BUCKETS)
+RESPONSE_BYTES = Histogram('fleet_response_size_bytes', 'Response body size', ['endpoint'],
+                           buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864))
+REQUESTS_IN_PROGRESS = Gauge('fleet_requests_in_progress', 'Requests being served',
+                             multiprocess_mode='livesum')
+STAGE_SECONDS = Histogram('fleet_stage_duration_seconds', 'Time spent in data loading and view computation stages',
+                          ['stage'], buckets=STAGE_BUCKETS)
+CACHE_LOOKUPS = Counter('fleet_cache_lookups_total', 'Cache lookups by outcome', ['cache', 'result'])
+PASSWORD_SECONDS = Histogram('fleet_password_hash_seconds', 'Password hashing and verification time',
+                             ['operation'], buckets=STAGE_BUCKETS)
+DATASET_ROWS = Gauge('fleet_dataset_rows', 'Rows in the loaded dataset', ['frame'],
+                     multiprocess_mode='livemostrecent')
+DATASET_BYTES = Gauge('fleet_dataset_bytes', 'Memory held by the loaded dataset', ['frame'],
+                      multiprocess_mode='livemostrecent')
+
+
+def timed(stage):
+    return STAGE_SECONDS.labels(stage).time()
+
+
+class MetricsMiddleware:
+    # Times each request until its body is fully sent and counts the bytes,
+    # so streamed tables and exports are measured like everything else
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        status = []
+
+        def capture(line, headers, exc_info=None):
+            status.append(line.split(' ', 1)[0])
+            return start_response(line, headers, exc_info)
+
+        sent = [0]
+
+        def count(body):
+            for chunk in body:
+                sent[0] += len(chunk)
+                yield chunk
+
+        def finish():
+            endpoint = environ.get('fleet.endpoint', 'unmatched')
+            REQUEST_SECONDS.labels(endpoint, environ['REQUEST_METHOD'], status[0] if status else '500').observe(
+                time.perf_counter() - started)
+            RESPONSE_BYTES.labels(endpoint).observe(sent[0])
+            REQUESTS_IN_PROGRESS.dec()
+
+        REQUESTS_IN_PROGRESS.inc()
+        try:
+            body = self.wsgi_app(environ, capture)
+        except Exception:
+            finish()
+            raise
+        return ClosingIterator(count(body), [getattr(body, 'close', None), finish])
+
+
+app.wsgi_app = MetricsMiddleware(app.wsgi_app)
+
+
+@app.before_request
+def tag_endpoint():
+    request.environ['fleet.endpoint'] = request.endpoint or 'unmatched'
+
+# Load Excel datasets. FLEET_FILE / CLOSURE_FILE point at other sources, which
+# may also be .csv or .parquet (e.g. generated data past Excel's row limit).
+fleet_file = os.environ.get('FLEET_FILE', 'fleet_50_entries.xlsx')
+closure_file = os.environ.get('CLOSURE_FILE', 'Trip_Closure_Sheet_Oct2024_Mar2025.xlsx')
+
+# Cleaned frames are cached as Feather (Arrow IPC) files keyed by the source
+# path, mtime and size, so only the first start after a workbook changes pays
+# for openpyxl parsing.
+CACHE_DIR = os.environ.get('FLEET_CACHE_DIR', os.path.join('/tmp', 'fleet_cache'))
+
+
+def clean_frame(frame):
+    frame.columns = frame.columns.str.strip()
+    frame['Trip Date'] = pd.to_datetime(frame['Trip Date'], errors='coerce')
+    frame['Day'] = frame['Trip Date'].dt.day
+    return frame
+
+
+def read_source(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.parquet':
+        return pd.read_parquet(path)
+    if extension == '.csv':
+        frame = pd.read_csv(path)
+        if 'Actual Delivery Date' in frame.columns:
+            frame['Actual Delivery Date'] = pd.to_datetime(frame['Actual Delivery Date'], errors='coerce')
+        return frame
+    return pd.read_excel(path)
+
+
+def cache_prefix(path):
+    source = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]
+    return os.path.join(CACHE_DIR, f"{os.path.basename(path)}.{source}.")
+
+
+def cache_path(path):
+    st = os.stat(path)
+    stamp = hashlib.sha1(f"{st.st_mtime_ns}:{st.st_size}".encode()).hexdigest()[:12]
+    return cache_prefix(path) + stamp + '.feather'
+
+
+def load_frame(path):
+    cached = cache_path(path)
+    if os.path.exists(cached):
+        try:
+            with timed('load.cache_read'):
+                return pd.read_feather(cached)
+        except Exception:
+            pass  # unreadable cache entry, rebuild it below
+
+    with timed('load.source_read'):
+        frame = read_source(path)
+    with timed('load.clean'):
+        frame = clean_frame(frame)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp = f"{cached}.{os.getpid()}.tmp"
+        frame.to_feather(tmp)
+        os.replace(tmp, cached)
+        # Drop entries written for older versions of the same workbook
+        for stale in glob.glob(cache_prefix(path) + '*.feather'):
+            if stale != cached:
+                os.remove(stale)
+    except Exception:
+        pass  # caching is best effort (pyarrow missing, read-only disk, ...)
+    return frame
+
+
+# Aggregate cube: one row per (Vehicle ID, Route, Trip Status, POD Status, Date)
+# with trip counts and financial sums, so dashboard filters and reports read a
+# few cube rows instead of re-scanning every trip. Day and Month are derived
+# from Date on the cube itself, and rows are kept sorted by Date so date
+# ranges and buckets are binary searches.
+CUBE_KEYS = ['Vehicle ID', 'Route', 'Trip Status', 'POD Status']
+DAYS = list(range(1, 32))
+BUCKETS = {'day': 'D', 'week': 'W', 'month': 'M', 'year': 'Y'}
+CHART_MAX_POINTS = 62
+# Longest from/to range a request may chart; past CHART_MAX_POINTS months
+# 'auto' falls back to one point a year, so this caps that too
+RANGE_MAX_YEARS = 20
+
+
+CUBE_MEASURES = ['rows', 'trips', 'rev', 'exp', 'profit', 'kms']
+
+
+def build_cube(frame):
+    keys = [frame[k] for k in CUBE_KEYS if k in frame.columns]
+    keys.append(frame['Trip Date'].dt.normalize().rename('Date'))
+    cube = frame.groupby(keys, dropna=False, sort=True).agg(
+        rows=('Trip Status', 'size'),
+        trips=('Trip ID', 'count'),
+        rev=('Freight Amount', 'sum'),
+        exp=('Total Trip Expense', 'sum'),
+        profit=('Net Profit', 'sum'),
+        kms=('Actual Distance (KM)', 'sum'),
+    ).reset_index()
+    cube = date_parts(cube)
+    return cube.sort_values('Date', kind='stable', na_position='last', ignore_index=True)
+
+
+def date_parts(cube):
+    # Day and 'YYYY-MM' Month of every cell, formatting each month once
+    months, inverse = np.unique(cube['Date'].to_numpy().astype('datetime64[M]'), return_inverse=True)
+    labels = pd.Series(months.astype('datetime64[s]')).dt.strftime('%Y-%m').array
+    return cube.assign(Day=cube['Date'].dt.day, Month=labels.take(inverse.ravel()))
+
+
+def index_cube(cube):
+    # Cube row positions per vehicle and per route make a filter change a take
+    by_vehicle = cube.groupby('Vehicle ID', sort=False).indices
+    by_route = cube.groupby('Route', sort=False).indices if 'Route' in cube.columns else {}
+    return by_vehicle, by_route
+
+
+def date_bounds(dates, start=None, end=None):
+    # dates are sorted with NaT last; numpy orders NaT after every date, so
+    # both bounds are plain binary searches. end is inclusive of its day.
+    lo = np.searchsorted(dates, start.to_datetime64()) if start is not None else 0
+    if end is not None:
+        hi = np.searchsorted(dates, (end.normalize() + pd.Timedelta(days=1)).to_datetime64())
+    elif start is not None:
+        hi = np.searchsorted(dates, np.datetime64('NaT'))
+    else:
+        hi = len(dates)
+    return lo, hi
+
+
+def resolve_bucket(bucket, first, last):
+    # 'auto' picks the finest level that keeps a chart within CHART_MAX_POINTS
+    if bucket != 'auto':
+        return bucket
+    if pd.isna(first) or pd.isna(last):
+        return 'day'
+    days = (last.normalize() - first.normalize()).days + 1
+    months = (last.year - first.year) * 12 + last.month - first.month + 1
+    for name, points in (('day', days), ('week', days // 7 + 2), ('month', months)):
+        if points <= CHART_MAX_POINTS:
+            return name
+    return 'year'
+
+
+def bucket_axis(first, last, bucket):
+    bucket = resolve_bucket(bucket, first, last)
+    if pd.isna(first) or pd.isna(last) or first > last:
+        return bucket, pd.PeriodIndex([], freq=BUCKETS[bucket])
+    return bucket, pd.period_range(first, last, freq=BUCKETS[bucket])
+
+
+def bucket_labels(axis):
+    fmt = {'M': '%Y-%m', 'Y': '%Y', 'A': '%Y'}.get(axis.freqstr[:1], '%Y-%m-%d')
+    return [p.start_time.strftime(fmt) for p in axis]
+
+
+def bucket_sums(dates, values, axis):
+    # Sorted dates make each bucket one contiguous np.add.reduceat segment
+    if not len(axis):
+        return np.zeros(0, dtype=values.dtype)
+    starts = np.searchsorted(dates, axis.start_time.to_numpy())
+    stop = np.searchsorted(dates, axis[-1].end_time.to_datetime64(), 'right')
+    sums = np.add.reduceat(np.append(values[:stop], 0), starts)
+    sums[np.diff(np.append(starts, stop)) <= 0] = 0
+    return sums
+
+
+def summarize_kpis(part):
+    status = part.groupby('Trip Status')['rows'].sum()
+    audit = part[part['Trip Status'] == 'Under Audit']
+
+    rev = part['rev'].sum()
+    exp = part['exp'].sum()
+    profit = part['profit'].sum()
+    kms = part['kms'].sum()
 
-# Load Excel datasets
-fleet_file = 'fleet_50_entries.xlsx'
-closure_file = 'Trip_Closure_Sheet_Oct2024_Mar2025.xlsx'
+    rev_m = round(rev / 1e6, 2)
+    exp_m = round(exp / 1e6, 2)
+    profit_m = round(profit / 1e6, 2)
 
-df = pd.read_excel(fleet_file)
-df.columns = df.columns.str.strip()
-df['Trip Date'] = pd.to_datetime(df['Trip Date'], errors='coerce')
-df['Day'] = df['Trip Date'].dt.day
+    return {
+        'total_trips': int(part['rows'].sum()),
+        'ongoing': int(status.get('Pending Closure', 0)),
+        'closed': int(status.get('Completed', 0)),
+        'flags': int(status.get('Under Audit', 0)),
+        'resolved': int(audit.loc[audit['POD Status'] == 'Yes', 'rows'].sum()),
+        'rev': rev, 'exp': exp, 'profit': profit, 'kms': kms,
+        'rev_m': rev_m, 'exp_m': exp_m, 'profit_m': profit_m,
+        'kms_k': round(kms / 1e3, 1),
+        'per_km': round(profit / kms, 2) if kms else 0,
+        'profit_pct': round((profit / rev) * 100, 1) if rev else 0,
+        'bar_labels': ['Revenue', 'Expense', 'Profit'],
+        'bar_values': [float(rev_m), float(exp_m), float(profit_m)],
+        'top_vehicle': part.groupby('Vehicle ID')['profit'].sum().idxmax() if len(part) else None,
+        # Cube cells do not keep workbook row order, so routes with equal
+        # trip counts rank alphabetically
+        'top_routes': ", ".join(part.groupby('Route')['rows'].sum().sort_values(ascending=False, kind='stable').head(2).index) if 'Route' in part.columns else "N/A",
+    }
 
-# Load closure data for financial dashboard
-closure_df = pd.read_excel(closure_file)
-closure_df.columns = closure_df.columns.str.strip()
-closure_df['Trip Date'] = pd.to_datetime(closure_df['Trip Date'], errors='coerce')
-closure_df['Day'] = closure_df['Trip Date'].dt.day
 
-vehicles = sorted(df['Vehicle ID'].dropna().unique())
-routes = sorted(df['Route'].dropna().unique()) if 'Route' in df.columns else []
+def chart_series(labels, daily, audited):
+    audit_pct = [round(a / b * 100, 1) if b else 0 for a, b in zip(audited, daily)]
+    return {'labels': labels, 'daily': daily, 'audited': audited, 'audit_pct': audit_pct}
+
+
+def summarize_cube(part, axis=None):
+    if axis is None:
+        audit = part[part['Trip Status'] == 'Under Audit']
+        daily = part.groupby('Day')['trips'].sum().reindex(DAYS, fill_value=0).tolist()
+        audited = audit.groupby('Day')['trips'].sum().reindex(DAYS, fill_value=0).tolist()
+        labels = DAYS
+    else:
+        dates = part['Date'].to_numpy()
+        trips = part['trips'].to_numpy()
+        daily = bucket_sums(dates, trips, axis).tolist()
+        audited = bucket_sums(dates, np.where(part['Trip Status'] == 'Under Audit', trips, 0), axis).tolist()
+        labels = bucket_labels(axis)
+    return dict(summarize_kpis(part), **chart_series(labels, daily, audited))
+
+
+# Rollup pyramid: per-day totals of trip counts by status and the financial
+# columns, re-aggregated to week, month and year. Long-range charts read a
+# bounded number of precomputed buckets instead of re-grouping raw rows.
+ROLLUP_COLUMNS = {'rev': 'Freight Amount', 'exp': 'Total Trip Expense',
+                  'profit': 'Net Profit', 'kms': 'Actual Distance (KM)'}
+
+
+def build_rollups(frame):
+    has_id = frame['Trip ID'].notna()
+    status = frame['Trip Status']
+    values = pd.DataFrame({
+        'trips': has_id,
+        'pending': has_id & (status == 'Pending Closure'),
+        'completed': has_id & (status == 'Completed'),
+        'audit': has_id & (status == 'Under Audit'),
+    }).astype('int64')
+    for name, column in ROLLUP_COLUMNS.items():
+        values[name] = frame[column].to_numpy(dtype='float64', na_value=0)
+    day = values.groupby(frame.index.to_period('D')).sum()
+    pyramid = {'day': day}
+    for bucket in ('week', 'month', 'year'):
+        pyramid[bucket] = day.groupby(day.index.asfreq(BUCKETS[bucket])).sum()
+    # Whole-frame totals, undated rows included
+    pyramid['total'] = values.sum()
+    return pyramid
+
+
+def rollup_series(pyramid, bucket, axis, start=None, end=None):
+    series = pyramid[bucket].reindex(axis, fill_value=0)
+    if bucket != 'day' and len(axis):
+        day = pyramid['day']
+        # Edge buckets only partly inside the range are re-summed from days
+        if start is not None and start > axis[0].start_time:
+            series.iloc[0] = day.loc[pd.Period(start, 'D'):axis[0].asfreq('D', 'end')].sum()
+        if end is not None and end.normalize() < axis[-1].end_time.normalize():
+            lo = max(start, axis[-1].start_time) if start is not None else axis[-1].start_time
+            series.iloc[-1] = day.loc[pd.Period(lo, 'D'):pd.Period(end, 'D')].sum()
+    return series
+
+
+def rollup_totals(pyramid, start=None, end=None):
+    if start is None and end is None:
+        return pyramid['total']
+    day = pyramid['day']
+    return day.loc[pd.Period(start, 'D') if start is not None else None:
+                   pd.Period(end, 'D') if end is not None else None].sum()
+
+
+# Report engine: every report is a summary of a cube slice, so reports by
+# vehicle, route, date range or month never go back to the trip rows.
+def slice_dates(part, start=None, end=None):
+    if start is None and end is None:
+        return part
+    lo, hi = date_bounds(part['Date'].to_numpy(), start, end)
+    return part.iloc[lo:hi]
+
+
+def report_json(m):
+    return {
+        'total_trips': m['total_trips'], 'ongoing': m['ongoing'], 'closed': m['closed'],
+        'flags': m['flags'], 'resolved': m['resolved'],
+        'revenue': float(m['rev']), 'expense': float(m['exp']), 'profit': float(m['profit']),
+        'kms': float(m['kms']), 'per_km': float(m['per_km']), 'profit_pct': float(m['profit_pct']),
+        'avg_profit_per_trip': round(float(m['profit']) / m['total_trips'], 2) if m['total_trips'] else 0,
+        'top_vehicle': m['top_vehicle'], 'top_routes': m['top_routes'],
+    }
 
 
-import os
+def compare_months(part):
+    months = []
+    previous = None
+    for month, group in part.groupby('Month', sort=True):
+        current = report_json(summarize_cube(group))
+        current['month'] = month
+        if previous:
+            current['change'] = {k: round(current[k] - previous[k], 2)
+                                 for k in ('total_trips', 'revenue', 'expense', 'profit', 'kms')}
+        months.append(current)
+        previous = current
+    return months
+
+
+# Compact in-memory representation: repeated strings (always the filter
+# columns) become categoricals with sorted categories, so filters compare
+# category codes, and numerics take the narrowest dtype that holds every
+# value exactly. The columns the cube and rollups sum (ROLLUP_COLUMNS) keep
+# their dtype: every value may be exact in float32 while a float32 sum of a
+# million of them is not.
+CATEGORY_COLUMNS = ['Vehicle ID', 'Route', 'Trip Status', 'POD Status']
+CATEGORY_MAX_RATIO = 0.5
+# closure_df only feeds the financial views (Vehicle ID places a closure in
+# its owner's partition)
+CLOSURE_COLUMNS = ['Trip ID', 'Trip Date', 'Vehicle ID', 'Trip Status'] + list(ROLLUP_COLUMNS.values())
+
+
+def compact_frame(frame, columns=None, like=None):
+    # like: an already compacted frame whose columns and categoricals to follow
+    if columns is None:
+        columns = list(like.columns) if like is not None else list(frame.columns)
+    compact = {}
+    for column in columns:
+        values = frame[column]
+        if like is not None:
+            categorical = isinstance(like[column].dtype, pd.CategoricalDtype)
+        else:
+            categorical = pd.api.types.is_string_dtype(values.dtype) and (
+                column in CATEGORY_COLUMNS or values.nunique() <= CATEGORY_MAX_RATIO * len(values))
+        if categorical:
+            values = values.astype('category')
+        elif column in ROLLUP_COLUMNS.values():
+            pass
+        elif pd.api.types.is_integer_dtype(values.dtype):
+            values = pd.to_numeric(values, downcast='integer')
+        elif pd.api.types.is_float_dtype(values.dtype):
+            narrow = values.astype('float32')
+            if ((narrow.astype('float64') == values) | values.isna()).all():
+                values = narrow
+        compact[column] = values
+    return pd.DataFrame(compact, index=frame.index)
+
+
+def align_categories(left, right):
+    # One sorted category list per shared column, so concat stays categorical
+    for column in left.columns:
+        if column not in right.columns or not isinstance(left[column].dtype, pd.CategoricalDtype):
+            continue
+        other = right[column]
+        other = other.cat.categories if isinstance(other.dtype, pd.CategoricalDtype) else pd.Index(other.dropna().unique())
+        categories = left[column].cat.categories.union(other)
+        if not categories.equals(left[column].cat.categories):
+            left = left.assign(**{column: left[column].cat.set_categories(categories)})
+        right = right.assign(**{column: right[column].astype(pd.CategoricalDtype(categories))})
+    return left, right
+
+
+def index_by_date(frame):
+    # Trips sorted by Trip Date (undated last) on a DatetimeIndex
+    frame = frame.sort_values('Trip Date', kind='stable', na_position='last')
+    frame.index = pd.DatetimeIndex(frame['Trip Date'].to_numpy())
+    return frame
+
+
+def month_partitions(frame):
+    # 'YYYY-MM' -> (first row, end row) of each month in a date-sorted frame
+    dates = frame.index.to_numpy()
+    dated = np.searchsorted(dates, np.datetime64('NaT'))
+    months, starts = np.unique(dates[:dated].astype('datetime64[M]'), return_index=True)
+    ends = np.append(starts[1:], dated)
+    return {str(m): (int(s), int(e)) for m, s, e in zip(months, starts, ends)}
+
+
+# Delta maintenance: an ingested batch is aggregated on its own and merged
+# into the existing structures. Only the batch's rows are grouped; its cube
+# cells are found in the cube by key and added in, or inserted in order.
+def cell_codes(cube, delta, keys):
+    # One int64 per cell of each cube, ordered the way build_cube orders
+    # cells: by Date (undated last), then by each key (missing last). The
+    # cubes share their categories (align_categories) and are date sorted.
+    days, first, last = [], None, None
+    for frame in (cube, delta):
+        dates = frame['Date'].to_numpy().astype('datetime64[D]')
+        dated = np.searchsorted(dates, np.datetime64('NaT'))
+        if dated:
+            first = dates[0] if first is None else min(first, dates[0])
+            last = dates[dated - 1] if last is None else max(last, dates[dated - 1])
+        days.append(dates)
+    first = first if first is not None else np.datetime64(0, 'D')
+    last = last if last is not None else first
+    span = int((last - first).astype('int64')) + 1
+    codes = [np.where(np.isnat(d), span, (d - first).astype('int64')) for d in days]
+    for key in keys:
+        columns = (cube[key], delta[key])
+        if isinstance(columns[0].dtype, pd.CategoricalDtype):
+            size = len(columns[0].cat.categories)
+            digits = [column.cat.codes.to_numpy().astype('int64') for column in columns]
+            digits = [np.where(d < 0, size, d) for d in digits]
+        else:
+            # Keys that stayed uncompacted: rank them among their values
+            values = pd.Index(pd.concat(columns).dropna().unique()).sort_values()
+            size = len(values)
+            digits = [np.where(column.isna().to_numpy(), size, values.get_indexer(column)) for column in columns]
+        codes = [code * (size + 1) + digit for code, digit in zip(codes, digits)]
+    return codes
+
+
+def merge_cube(cube, delta):
+    # Returns the merged cube, the new positions of the cube's cells, and
+    # the delta's cells that were not in the cube with their positions
+    cube, delta = align_categories(cube, delta)
+    keys = [k for k in CUBE_KEYS if k in cube.columns]
+    old, new = cell_codes(cube, delta, keys)
+    at = np.searchsorted(old, new)
+    hit = np.zeros(len(new), dtype=bool)
+    if len(old):
+        hit = old[np.minimum(at, len(old) - 1)] == new
+    sums = {}
+    for measure in CUBE_MEASURES:
+        values = cube[measure].to_numpy(dtype=np.result_type(cube[measure].dtype, delta[measure].dtype), copy=True)
+        values[at[hit]] += delta[measure].to_numpy()[hit]
+        sums[measure] = values
+    added = date_parts(delta.loc[~hit, keys + ['Date'] + CUBE_MEASURES])[list(cube.columns)]
+    merged, old_at, new_at = insert_rows(cube.assign(**sums), added, at[~hit])
+    return merged.reset_index(drop=True), old_at, added.reset_index(drop=True), new_at
+
+
+def merge_rollups(pyramid, delta):
+    merged = {'total': pyramid['total'] + delta['total']}
+    for bucket in ('day', 'week', 'month', 'year'):
+        merged[bucket] = pd.concat([pyramid[bucket], delta[bucket]]).groupby(level=0).sum()
+    return merged
+
+
+def insert_rows(frame, rows, at):
+    # frame with rows[i] placed before frame's row at[i] (at is sorted).
+    # Returns the merged frame and the new positions of old and inserted rows.
+    n, b = len(frame), len(rows)
+    old_at = np.arange(n) + np.searchsorted(at, np.arange(n), 'right')
+    new_at = at + np.arange(b)
+    order = np.empty(n + b, dtype=np.intp)
+    order[old_at] = np.arange(n)
+    order[new_at] = n + np.arange(b)
+    return pd.concat([frame, rows]).take(order), old_at, new_at
+
+
+def merge_rows(frame, batch):
+    # Insert the date-sorted batch after existing rows of the same date
+    frame, batch = align_categories(frame, batch)
+    return insert_rows(frame, batch, np.searchsorted(frame.index.to_numpy(), batch.index.to_numpy(), 'right'))
+
+
+def merge_positions(positions, batch_positions, old_at, new_at):
+    merged = {key: old_at[rows] for key, rows in positions.items()}
+    for key, rows in batch_positions.items():
+        added = new_at[rows]
+        merged[key] = np.sort(np.concatenate([merged[key], added])) if key in merged else added
+    return merged
+
+
+def month_bounds(frame, months):
+    # Month partitions of a date-sorted frame found by binary search
+    dates = frame.index.to_numpy()
+    starts = np.array(sorted(months), dtype='datetime64[M]')
+    lo = np.searchsorted(dates, starts.astype(dates.dtype))
+    hi = np.searchsorted(dates, (starts + 1).astype(dates.dtype))
+    return {str(m): (int(s), int(e)) for m, s, e in zip(starts, lo, hi)}
+
+
+def batch_months(batch):
+    return set(batch['Trip Date'].dropna().dt.strftime('%Y-%m'))
+
+
+# Audit rules flag trips for the Trip Auditor queue, next to the ones tagged
+# 'Under Audit' by hand. Each rule is one vectorized check over a whole frame
+# ('trips' and/or 'closures'). 'value' is a column or a (numerator,
+# denominator) ratio; 'by' lists candidate group keys and the first whose
+# columns all exist is used, so workbooks without a Route column group by
+# Origin and Destination. Group checks skip groups under 'min_group' rows.
+# Every row gets a bit per rule, so there can be at most 32 rules.
+AUDIT_RULES = [
+    {'name': 'expense_per_km', 'title': 'Expense per KM is an outlier for the vehicle on this route',
+     'frames': ['trips'], 'kind': 'outlier', 'value': ('Total Trip Expense', 'Actual Distance (KM)'),
+     'by': [['Vehicle ID', 'Route'], ['Vehicle ID', 'Origin', 'Destination']],
+     'threshold': 3.5, 'min_group': 5},
+    {'name': 'profit_sign', 'title': 'Net profit sign disagrees with freight minus expense',
+     'frames': ['trips', 'closures'], 'kind': 'sign_mismatch', 'value': 'Net Profit',
+     'expected': ('Freight Amount', 'Total Trip Expense')},
+    {'name': 'missing_pod', 'title': 'Completed trip without a POD',
+     'frames': ['trips'], 'kind': 'condition',
+     'when': [('Trip Status', '==', 'Completed'), ('POD Status', '!=', 'Yes')]},
+    {'name': 'route_distance', 'title': "Distance far from the route's median",
+     'frames': ['trips'], 'kind': 'median_ratio', 'value': 'Actual Distance (KM)',
+     'by': [['Route'], ['Origin', 'Destination']], 'low': 0.5, 'high': 1.5, 'min_group': 5},
+]
+AUDIT_OPERATORS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le,
+                   '>': operator.gt, '>=': operator.ge}
+
+
+def audit_values(frame, value):
+    columns = value if isinstance(value, tuple) else (value,)
+    if not all(c in frame.columns for c in columns):
+        return None
+    if not isinstance(value, tuple):
+        return frame[value].to_numpy(dtype='float64', na_value=np.nan)
+    num, den = (frame[c].to_numpy(dtype='float64', na_value=np.nan) for c in value)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(den > 0, num / den, np.nan)
+
+
+def audit_groups(frame, rule):
+    # Group number of every row for a rule (-1 where a key is missing)
+    keys = next((k for k in rule['by'] if all(c in frame.columns for c in k)), None)
+    if keys is None:
+        return None
+    return frame.groupby(keys, sort=False, observed=True).ngroup().to_numpy()
+
+
+def group_median(values, codes):
+    return pd.Series(values).groupby(codes).transform('median').to_numpy()
+
+
+def group_size(values, codes):
+    # Rows with a value in each row's group
+    size = pd.Series(values).groupby(codes).transform('count').to_numpy()
+    return np.where(codes < 0, 0, size)
+
+
+def check_condition(frame, rule):
+    if not all(column in frame.columns for column, _, _ in rule['when']):
+        return None
+    hit = np.ones(len(frame), dtype=bool)
+    for column, op, value in rule['when']:
+        hit &= AUDIT_OPERATORS[op](frame[column], value).to_numpy(dtype=bool, na_value=False)
+    return hit
+
+
+def check_sign_mismatch(frame, rule):
+    actual = audit_values(frame, rule['value'])
+    plus, minus = (audit_values(frame, c) for c in rule['expected'])
+    if actual is None or plus is None or minus is None:
+        return None
+    # Rounded to paise so float noise around zero is not a mismatch
+    expected = (plus - minus).round(2)
+    return (np.sign(actual.round(2)) != np.sign(expected)) & ~np.isnan(actual) & ~np.isnan(expected)
+
+
+def check_outlier(frame, rule):
+    # Robust z-score (median and MAD) within the group
+    values = audit_values(frame, rule['value'])
+    codes = audit_groups(frame, rule)
+    if values is None or codes is None:
+        return None
+    deviation = np.abs(values - group_median(values, codes))
+    mad = group_median(deviation, codes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = 0.6745 * deviation / mad
+    return (group_size(values, codes) >= rule['min_group']) & (mad > 0) & (score > rule['threshold'])
+
+
+def check_median_ratio(frame, rule):
+    values = audit_values(frame, rule['value'])
+    codes = audit_groups(frame, rule)
+    if values is None or codes is None:
+        return None
+    median = group_median(values, codes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = values / median
+    return ((group_size(values, codes) >= rule['min_group']) & (median > 0)
+            & ((ratio < rule['low']) | (ratio > rule['high'])))
+
+
+AUDIT_CHECKS = {'condition': check_condition, 'sign_mismatch': check_sign_mismatch,
+                'outlier': check_outlier, 'median_ratio': check_median_ratio}
+
+
+def run_audit(frames):
+    # One batch pass of every rule; returns a bit mask per row of each frame
+    # (bit i set when AUDIT_RULES[i] flags it) and per-rule flagged counts
+    started = time.perf_counter()
+    masks = {name: np.zeros(len(frame), dtype=np.uint32) for name, frame in frames.items()}
+    counts = {}
+    for bit, rule in enumerate(AUDIT_RULES):
+        counts[rule['name']] = {}
+        for name in rule['frames']:
+            with timed('audit.' + rule['name']):
+                hit = AUDIT_CHECKS[rule['kind']](frames[name], rule)
+            if hit is not None:
+                masks[name] |= hit.astype(np.uint32) << np.uint32(bit)
+                counts[rule['name']][name] = int(np.count_nonzero(hit))
+    return {'masks': masks, 'counts': counts, 'seconds': round(time.perf_counter() - started, 3)}
+
+
+def audit_labels(mask):
+    # Comma-joined rule names per row, as a categorical: few distinct values
+    values, inverse = np.unique(mask, return_inverse=True)
+    names = [', '.join(r['name'] for bit, r in enumerate(AUDIT_RULES) if int(v) >> bit & 1) for v in values]
+    return pd.Categorical.from_codes(inverse.ravel(), categories=names)
+
+
+def trip_index(frame):
+    # Hash index on Trip ID, built at load rather than on the first lookup
+    index = pd.Index(frame['Trip ID'], name='Trip ID')
+    index.is_unique  # evaluated only to warm the index's hash table cache
+    return index
+
+
+def index_positions(index, key):
+    # Row positions of one key: O(1) through the index's hash table
+    try:
+        loc = index.get_loc(key)
+    except KeyError:
+        return np.empty(0, dtype=np.intp)
+    if isinstance(loc, slice):
+        return np.arange(len(index))[loc]
+    if isinstance(loc, np.ndarray):
+        return np.flatnonzero(loc)
+    return np.array([loc])
+
+
+# Reconciliation pairs fleet and closure rows by Trip ID and reports trips
+# missing from either side, or whose amounts differ by more than
+# RECONCILE_TOLERANCE. A Trip ID repeated on one side is matched by its first
+# row and counted under 'duplicate_ids'.
+RECONCILE_COLUMNS = ['Freight Amount', 'Total Trip Expense', 'Net Profit', 'Actual Distance (KM)']
+RECONCILE_TOLERANCE = 0.01
+RECONCILE_ISSUES = ['missing in closure', 'missing in fleet', 'amounts differ']
+
+
+def take_values(frame, column, positions):
+    # Column values at positions, NaN where the position is -1
+    values = frame[column].to_numpy(dtype='float64', na_value=np.nan).take(np.maximum(positions, 0))
+    return np.where(positions >= 0, values, np.nan)
+
+
+def amounts_differ(a, b):
+    return ~(np.abs(a - b) <= RECONCILE_TOLERANCE) & ~(np.isnan(a) & np.isnan(b))
+
+
+def first_rows(ids):
+    # Each distinct Trip ID once, and the position of its first row
+    if ids.is_unique:
+        return ids, np.arange(len(ids))
+    keep = ~ids.duplicated()
+    return ids[keep], np.flatnonzero(keep)
+
+
+def reconcile(dataset):
+    fleet, closure = dataset.df, dataset.closure_df
+    ids = dataset.closure_trip_ids
+    probe, first = first_rows(ids)
+    # The one indexed join: every fleet Trip ID probes the closure hash index
+    hit = probe.get_indexer(dataset.trip_ids)
+    matched = hit >= 0
+    found = np.zeros(len(first), dtype=bool)
+    found[hit[matched]] = True
+
+    both_left, both_right = np.flatnonzero(matched), first[hit[matched]]
+    columns = [c for c in RECONCILE_COLUMNS if c in fleet.columns and c in closure.columns]
+    differs = np.zeros(len(both_left), dtype=bool)
+    totals = {}
+    for column in columns:
+        a, b = take_values(fleet, column, both_left), take_values(closure, column, both_right)
+        bad = amounts_differ(a, b)
+        differs |= bad
+        totals[column] = {'differ': int(np.count_nonzero(bad)), 'fleet_total': round(float(np.nansum(a)), 2),
+                          'closure_total': round(float(np.nansum(b)), 2)}
+
+    fleet_only, closure_only = np.flatnonzero(~matched), first[~found]
+    left = np.concatenate([fleet_only, both_left[differs], np.full(len(closure_only), -1)])
+    right = np.concatenate([np.full(len(fleet_only), -1), both_right[differs], closure_only])
+    issue = np.repeat([0, 2, 1], [len(fleet_only), int(differs.sum()), len(closure_only)])
+    from_fleet = left >= 0
+    rows = pd.DataFrame({
+        'Trip ID': np.where(from_fleet, dataset.trip_ids.to_numpy(dtype=object).take(np.maximum(left, 0)),
+                            ids.to_numpy(dtype=object).take(np.maximum(right, 0))),
+        'Trip Date': np.where(from_fleet, fleet['Trip Date'].to_numpy().take(np.maximum(left, 0)),
+                              closure['Trip Date'].to_numpy().take(np.maximum(right, 0))),
+        'Issue': pd.Categorical.from_codes(issue, categories=RECONCILE_ISSUES),
+    })
+    for column in columns:
+        rows[f'{column} (fleet)'] = take_values(fleet, column, left)
+        rows[f'{column} (closure)'] = take_values(closure, column, right)
+    rows = rows.sort_values('Trip Date', kind='stable', ignore_index=True)
+    summary = {
+        'fleet_trips': len(fleet), 'closure_trips': len(closure), 'matched': int(matched.sum()),
+        'missing_in_closure': len(fleet_only), 'missing_in_fleet': len(closure_only),
+        'amounts_differ': int(differs.sum()),
+        'duplicate_ids': {'fleet': int(dataset.trip_ids.duplicated().sum()), 'closure': int(len(ids) - len(first))},
+        'columns': totals,
+    }
+    return {'rows': rows, 'summary': summary}
+
+
+# Everything derived from the workbooks lives on one Dataset snapshot. A
+# snapshot is never modified after it is built: reloads build a new one and
+# swap it in, and each request keeps the snapshot it started with.
+class Dataset:
+    def __init__(self, version, df, closure_df):
+        self.version = version
+        # Workbook version (which keys the ingest journal), the version before
+        # any ingested batches, and how much of the journal is applied
+        self.source = self.base = version
+        self.journal_offset = 0
+        self.built = time.time()
+        # The owner a partition belongs to (see partition_by_owner)
+        self.owner = None
+        self.owners = None
+        self.partitions = {}
+        with timed('load.compact'):
+            # The cube derives its own Day, so the row frames drop it
+            df = compact_frame(df.drop(columns='Day'))
+            closure_df = compact_frame(closure_df, [c for c in CLOSURE_COLUMNS if c in closure_df.columns])
+        with timed('load.sort'):
+            self.df = index_by_date(df)
+            # Load closure data for financial dashboard
+            self.closure_df = index_by_date(closure_df)
+        self.build_indexes()
+
+    def build_indexes(self, cube=None):
+        df = self.df
+        self.months = month_partitions(self.df)
+        self.closure_months = month_partitions(self.closure_df)
+        self.first_date, self.last_date = df['Trip Date'].min(), df['Trip Date'].max()
+        self.vehicles = sorted(df['Vehicle ID'].dropna().unique())
+        self.routes = sorted(df['Route'].dropna().unique()) if 'Route' in df.columns else []
+        with timed('load.cube'):
+            self.cube = build_cube(df) if cube is None else cube
+        with timed('load.rollups'):
+            self.rollups = build_rollups(self.df)
+            self.closure_rollups = build_rollups(self.closure_df)
+        with timed('load.positions'):
+            self.cube_vehicle_positions, self.cube_route_positions = index_cube(self.cube)
+            self.status_positions = df.groupby('Trip Status', sort=False).indices
+            self.vehicle_positions = df.groupby('Vehicle ID', sort=False).indices
+            self.route_positions = df.groupby('Route', sort=False).indices if 'Route' in df.columns else {}
+        with timed('load.trip_index'):
+            self._derived = {'trip_ids': trip_index(self.df), 'closure_trip_ids': trip_index(self.closure_df)}
+        self._derived_lock = threading.Lock()
+
+    def partition(self, owner, rows, closure_rows, cube_rows):
+        # One owner's rows, still compacted and date sorted, with their own
+        # cube, rollups and indexes. The cube is keyed by vehicle, so the
+        # owner's cells are a slice of the whole fleet's.
+        part = copy.copy(self)
+        part.owner, part.partitions = owner, {}
+        part.df, part.closure_df = self.df.take(rows), self.closure_df.take(closure_rows)
+        part.build_indexes(self.cube.take(cube_rows).reset_index(drop=True))
+        return part
+
+    def for_owner(self, email):
+        # What an owner account sees: its partition, or nothing if it owns
+        # no vehicles. Without an owner mapping, the whole fleet.
+        if self.owners is None:
+            return self
+        return self.partitions.get(email) or self.partitions['']
+
+    # Hash indexes on Trip ID, built at load. A snapshot extended by ingested
+    # batches builds its own on first use rather than rehashing every row
+    # per batch.
+    @property
+    def trip_ids(self):
+        return self.derived('trip_ids', lambda: trip_index(self.df))
+
+    @property
+    def closure_trip_ids(self):
+        return self.derived('closure_trip_ids', lambda: trip_index(self.closure_df))
+
+    def derived(self, name, compute):
+        # Results over the whole snapshot, computed once on first use
+        if name not in self._derived:
+            with self._derived_lock:
+                if name not in self._derived:
+                    self._derived[name] = compute()
+        return self._derived[name]
+
+    def audit(self):
+        # Rule flags for every trip and closure row
+        def compute():
+            with timed('audit.scan'):
+                audit = run_audit({'trips': self.df, 'closures': self.closure_df})
+                queued = audit['masks']['trips'] != 0
+                queued[self.status_positions.get('Under Audit', [])] = True
+                audit['queue'] = np.flatnonzero(queued)
+                return audit
+        return self.derived('audit', compute)
+
+    def reconciliation(self):
+        def compute():
+            with timed('reconcile'):
+                return reconcile(self)
+        return self.derived('reconciliation', compute)
+
+    def trip(self, trip_id):
+        # Fleet and closure rows of one trip
+        return (self.df.take(index_positions(self.trip_ids, trip_id)),
+                self.closure_df.take(index_positions(self.closure_trip_ids, trip_id)))
+
+    def audit_queue(self, rule=None):
+        # Positions of trips awaiting audit: tagged 'Under Audit' or flagged by
+        # a rule; with a rule name, only the trips that rule flags
+        audit = self.audit()
+        if rule:
+            bit = next(i for i, r in enumerate(AUDIT_RULES) if r['name'] == rule)
+            return np.flatnonzero(audit['masks']['trips'] >> np.uint32(bit) & 1)
+        return audit['queue']
+
+    def cube_slice(self, vehicle=None, route=None):
+        empty = np.empty(0, dtype=np.intp)
+        if vehicle:
+            part = self.cube.take(self.cube_vehicle_positions.get(vehicle, empty))
+            if route:
+                part = part[part['Route'] == route] if 'Route' in part.columns else part.iloc[0:0]
+            return part
+        if route:
+            return self.cube.take(self.cube_route_positions.get(route, empty))
+        return self.cube
+
+    def rows_with_status(self, status):
+        return self.status_positions.get(status, np.empty(0, dtype=np.intp))
+
+    def rows_for(self, vehicle=None, route=None, start=None, end=None):
+        # Row positions matching the dashboard filters, without a frame scan
+        positions = np.arange(len(self.df))
+        if vehicle:
+            positions = self.vehicle_positions.get(vehicle, positions[:0])
+        if route:
+            route_rows = self.route_positions.get(route, positions[:0])
+            positions = np.intersect1d(positions, route_rows) if vehicle else route_rows
+        if start is not None or end is not None:
+            # Rows are date sorted, so the range is a contiguous block
+            lo, hi = date_bounds(self.df.index.to_numpy(), start, end)
+            positions = positions[np.searchsorted(positions, lo):np.searchsorted(positions, hi)]
+        return positions
+
+    def closures_between(self, start=None, end=None):
+        frame = self.closure_df
+        if start is not None and end is not None and start.day == 1 and end == start + pd.offsets.MonthEnd(0):
+            bounds = self.closure_months.get(start.strftime('%Y-%m'), (0, 0))
+        else:
+            bounds = date_bounds(frame.index.to_numpy(), start, end)
+        return frame.iloc[bounds[0]:bounds[1]]
+
+    def axis(self, start, end, bucket):
+        return bucket_axis(start if start is not None else self.first_date,
+                           end if end is not None else self.last_date, bucket)
+
+    def extended(self, version, journal_offset, trips=None, closures=None):
+        # A new snapshot with the batches merged into every derived structure
+        fresh = copy.copy(self)
+        fresh.version, fresh.journal_offset = version, journal_offset
+        fresh.built = time.time()
+        # Group medians and joins move with every batch: recompute on demand.
+        # A frame no batch touched keeps its Trip ID index.
+        fresh._derived = {}
+        for name, rows in (('trip_ids', trips), ('closure_trip_ids', closures)):
+            if (rows is None or not len(rows)) and name in self._derived:
+                fresh._derived[name] = self._derived[name]
+        fresh._derived_lock = threading.Lock()
+        if trips is not None and len(trips):
+            batch = index_by_date(compact_frame(trips, like=self.df))
+            fresh.df, old_at, new_at = merge_rows(self.df, batch)
+            fresh.months = month_bounds(fresh.df, self.months.keys() | batch_months(batch))
+            dates = fresh.df.index
+            dated = np.searchsorted(dates.to_numpy(), np.datetime64('NaT'))
+            fresh.first_date, fresh.last_date = (dates[0], dates[dated - 1]) if dated else (pd.NaT, pd.NaT)
+            fresh.vehicles = sorted(set(self.vehicles).union(batch['Vehicle ID'].dropna()))
+            if 'Route' in batch.columns:
+                fresh.routes = sorted(set(self.routes).union(batch['Route'].dropna()))
+
+            fresh.cube, cube_at, added, added_at = merge_cube(self.cube, build_cube(batch))
+            by_vehicle, by_route = index_cube(added)
+            fresh.cube_vehicle_positions = merge_positions(self.cube_vehicle_positions, by_vehicle, cube_at, added_at)
+            fresh.cube_route_positions = merge_positions(self.cube_route_positions, by_route, cube_at, added_at)
+            fresh.rollups = merge_rollups(self.rollups, build_rollups(batch))
+
+            for name, column in (('status_positions', 'Trip Status'), ('vehicle_positions', 'Vehicle ID'),
+                                 ('route_positions', 'Route')):
+                if column in batch.columns:
+                    setattr(fresh, name, merge_positions(getattr(self, name),
+                                                         batch.groupby(column, sort=False).indices, old_at, new_at))
+        if closures is not None and len(closures):
+            batch = index_by_date(compact_frame(closures, like=self.closure_df))
+            fresh.closure_df = merge_rows(self.closure_df, batch)[0]
+            fresh.closure_months = month_bounds(fresh.closure_df, self.closure_months.keys() | batch_months(batch))
+            fresh.closure_rollups = merge_rollups(self.closure_rollups, build_rollups(batch))
+        return fresh
+
+
+SOURCE_FILES = [fleet_file, closure_file]
+RELOAD_INTERVAL = float(os.environ.get('DATA_RELOAD_INTERVAL', '5'))
+
+
+# Owner partitions: OWNER_FILE (.csv, .xlsx or .parquet) maps each Vehicle ID
+# to the email of the owner account it belongs to. With a mapping, every
+# snapshot also holds one partition per owner with only that owner's trips
+# and closures (by their own Vehicle ID), and an owner's requests only ever
+# touch that partition and its own cached results. Without the file every
+# account sees the whole fleet, as do accounts whose role is not 'Owner'.
+OWNER_FILE = os.environ.get('OWNER_FILE', 'vehicle_owners.csv')
+OWNER_COLUMNS = ['Vehicle ID', 'Owner Email']
+
+
+_file_digests = {}
+
+
+def file_digest(path):
+    # Content hash of a file, recomputed only when its mtime or size changes
+    st = os.stat(path)
+    stat = (st.st_mtime_ns, st.st_size)
+    cached = _file_digests.get(path)
+    if cached is None or cached[0] != stat:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        cached = _file_digests[path] = (stat, digest.hexdigest())
+    return cached[1]
+
+
+def source_stamp():
+    # Cheap check for changed sources, the owner mapping included
+    stamp = []
+    for path in SOURCE_FILES + ([OWNER_FILE] if os.path.exists(OWNER_FILE) else []):
+        st = os.stat(path)
+        stamp.append(f"{os.path.abspath(path)}:{st.st_mtime_ns}:{st.st_size}")
+    return "|".join(stamp)
+
+
+def source_version():
+    # (workbook version, dataset version). Same contents give the same
+    # versions in every process, so touching or re-saving a workbook changes
+    # neither. The workbook version keys the ingest journal; the dataset
+    # version also covers the owner mapping.
+    source = hashlib.sha1("|".join(file_digest(p) for p in SOURCE_FILES).encode()).hexdigest()[:12]
+    if not os.path.exists(OWNER_FILE):
+        return source, source
+    return source, hashlib.sha1(f"{source}:{file_digest(OWNER_FILE)}".encode()).hexdigest()[:12]
+
+
+def load_owners():
+    # Vehicle ID -> owner email, or None without a mapping file
+    if not os.path.exists(OWNER_FILE):
+        return None
+    frame = read_source(OWNER_FILE)
+    frame.columns = frame.columns.astype(str).str.strip()
+    missing = [c for c in OWNER_COLUMNS if c not in frame.columns]
+    if missing:
+        raise ValueError(f"{OWNER_FILE}: missing columns: {', '.join(missing)}")
+    frame = frame[OWNER_COLUMNS].dropna().astype(str)
+    return dict(zip(frame['Vehicle ID'].str.strip(), frame['Owner Email'].str.strip()))
+
+
+def partition_by_owner(dataset, owners, previous=None):
+    # Split the snapshot's rows by owner. Ingest only appends, so an owner
+    # whose row counts are unchanged since previous keeps its partition (and
+    # whatever was computed on it); the rest are rebuilt from their rows.
+    dataset.owners, dataset.partitions = owners, {}
+    if owners is None:
+        return dataset
+    with timed('load.partitions'):
+        emails = sorted(set(owners.values()))
+
+        def owner_codes(column):
+            # Map each vehicle once, then look rows up by code (-1: no owner)
+            vehicles = column.astype('category')
+            owner_of = pd.Categorical(vehicles.cat.categories.astype(str).map(owners), categories=emails).codes
+            return np.append(owner_of, -1)[vehicles.cat.codes.to_numpy()]
+
+        codes = owner_codes(dataset.df['Vehicle ID'])
+        cube_codes = owner_codes(dataset.cube['Vehicle ID'])
+        # Closures belong to the owner of their own vehicle; one without a
+        # Vehicle ID falls back to the trip with the same Trip ID
+        closures = dataset.closure_df
+        if 'Vehicle ID' in closures.columns:
+            closure_codes = owner_codes(closures['Vehicle ID'])
+            unknown = closures['Vehicle ID'].isna().to_numpy()
+        else:
+            closure_codes = np.full(len(closures), -1)
+            unknown = np.ones(len(closures), dtype=bool)
+        if unknown.any():
+            ids, first = first_rows(dataset.trip_ids)
+            hit = ids.get_indexer(dataset.closure_trip_ids[unknown])
+            closure_codes[unknown] = np.where(hit >= 0, codes[first[np.maximum(hit, 0)]], -1)
+        rows = pd.Series(codes).groupby(codes).indices
+        closure_rows = pd.Series(closure_codes).groupby(closure_codes).indices
+        cube_rows = pd.Series(cube_codes).groupby(cube_codes).indices
+        empty = np.empty(0, dtype=np.intp)
+        # '' is the empty fleet of accounts that own no vehicles
+        split = [('', empty, empty, empty)] + [
+            (email, rows.get(i, empty), closure_rows.get(i, empty), cube_rows.get(i, empty))
+            for i, email in enumerate(emails)]
+        for email, mine, closures, cells in split:
+            kept = previous.partitions.get(email) if previous is not None and previous.owners == owners else None
+            if kept is not None and len(kept.df) == len(mine) and len(kept.closure_df) == len(closures):
+                part = copy.copy(kept)
+                part.version, part.source, part.journal_offset = dataset.version, dataset.source, dataset.journal_offset
+            else:
+                part = dataset.partition(email, mine, closures, cells)
+            dataset.partitions[email] = part
+    return dataset
+
+
+# Ingested trip and closure batches are appended to a JSON-lines journal that
+# is replayed on top of the workbooks, so every worker process and every
+# reload sees them. Workers apply only the journal tail they have not seen.
+# A journal belongs to the workbook version its first line names, and a
+# batch validated on other workbooks is refused rather than appended. New
+# workbook contents move the journal aside (INGEST_JOURNAL.<timestamp>) and
+# start a new one that carries every ingested row the workbooks do not
+# contain yet (by Trip ID).
+INGEST_JOURNAL = os.environ.get('INGEST_JOURNAL', os.path.join('/tmp', 'fleet_ingest.jsonl'))
+INGEST_MAX_ROWS = int(os.environ.get('INGEST_MAX_ROWS', '50000'))
+INGEST_DROPPED = Counter('fleet_ingest_dropped_rows_total', 'Journalled ingest rows not applied, by reason',
+                         ['reason'])
+REQUIRED_COLUMNS = ['Trip ID', 'Trip Date', 'Vehicle ID', 'Trip Status', 'POD Status',
+                    'Freight Amount', 'Total Trip Expense', 'Net Profit', 'Actual Distance (KM)']
+NOT_NULL_COLUMNS = ['Trip ID', 'Trip Date', 'Vehicle ID', 'Trip Status']
+
+
+def validate_batch(rows, template, known):
+    # Coerce raw rows to the columns of the frame they extend; known is every
+    # workbook column, the ones the frame does not keep are ignored
+    rows.columns = rows.columns.astype(str).str.strip()
+    columns = list(template.columns)
+    missing = [c for c in REQUIRED_COLUMNS if c in columns and c not in rows.columns]
+    if missing:
+        raise ValueError(f"Missing columns: {', '.join(missing)}")
+    unknown = [c for c in rows.columns if c not in known]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    batch = pd.DataFrame(index=range(len(rows)))
+    for column in columns:
+        values = rows[column].reset_index(drop=True) if column in rows.columns else pd.Series([None] * len(rows))
+        dtype = template[column].dtype
+        if pd.api.types.is_datetime64_any_dtype(dtype):
+            parsed = pd.to_datetime(values, errors='coerce').astype(dtype)
+        elif pd.api.types.is_numeric_dtype(dtype):
+            parsed = pd.to_numeric(values, errors='coerce')
+            if pd.api.types.is_integer_dtype(dtype) and parsed.notna().all() and (parsed % 1 == 0).all():
+                parsed = parsed.astype('int64')
+        else:
+            parsed = values.where(values.isna(), values.astype(str).str.strip()).astype('str')
+        given = values.notna() & (values.astype(str).str.strip() != '')
+        bad = np.flatnonzero(given & parsed.isna())
+        if len(bad):
+            raise ValueError(f"Invalid {column!r} in row {bad[0] + 1}: {values[bad[0]]}")
+        if column in NOT_NULL_COLUMNS and parsed.isna().any():
+            raise ValueError(f"Missing {column!r} in row {np.flatnonzero(parsed.isna())[0] + 1}")
+        batch[column] = parsed
+    return batch
+
+
+def read_journal(offset):
+    # Complete journal lines after offset, and the offset just past them. A
+    # line that does not parse is logged and skipped.
+    try:
+        with open(INGEST_JOURNAL, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], offset
+    end = data.rfind(b'\n') + 1
+    entries = []
+    for line in data[:end].splitlines():
+        if not line.strip():
+            continue
+        try:
+            entries.append(json.loads(line))
+        except ValueError as e:
+            app.logger.warning("Skipping unreadable ingest journal line: %s", e)
+    return entries, offset + end
+
+
+def same_file(f, path):
+    try:
+        return os.fstat(f.fileno()).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
+
+
+def journal_source(line):
+    # The workbook version a journal's first line names
+    try:
+        return json.loads(line).get('source')
+    except (ValueError, AttributeError):
+        return None
+
+
+def journal_line(kind, batch, source):
+    rows = batch.to_json(orient='records', date_format='iso')
+    return f'{{"kind": {json.dumps(kind)}, "source": {json.dumps(source)}, "rows": {rows}}}\n'
+
+
+def append_journal(kind, batch, source):
+    # False if the journal has moved on to other workbooks than the ones the
+    # batch was validated on
+    line = journal_line(kind, batch, source)
+    while True:
+        with open(INGEST_JOURNAL, 'a+', encoding='utf-8') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # Moved aside (rotate_journal) while this waited: use the new one
+            if not same_file(f, INGEST_JOURNAL):
+                continue
+            f.seek(0)
+            first = f.readline()
+            if not first:
+                f.write(f'{{"source": {json.dumps(source)}}}\n')
+            elif journal_source(first) != source:
+                return False
+            f.write(line)
+            return True
+
+
+def carry_journal(f, dataset):
+    # Journal lines for new workbooks: the batches in f without the rows
+    # whose Trip IDs the workbooks now contain
+    templates = {'trips': dataset.df, 'closures': dataset.closure_df}
+    known = {'trips': dataset.trip_ids, 'closures': dataset.closure_trip_ids}
+    lines, carried, superseded = [], 0, 0
+    for line in f:
+        try:
+            entry = json.loads(line)
+        except ValueError as e:
+            INGEST_DROPPED.labels('invalid').inc()
+            app.logger.error("Dropping unreadable ingest journal line: %s", e)
+            continue
+        if not isinstance(entry, dict) or 'kind' not in entry:
+            continue
+        kind, rows = entry['kind'], entry.get('rows')
+        try:
+            batch = validate_batch(pd.DataFrame.from_records(rows), templates[kind], dataset.df.columns)
+        except (KeyError, TypeError, ValueError) as e:
+            INGEST_DROPPED.labels('invalid').inc(len(rows) if isinstance(rows, list) else 1)
+            app.logger.error("Dropping ingest journal entry that does not fit the new workbooks: %s", e)
+            continue
+        new = batch[~batch['Trip ID'].isin(known[kind]).to_numpy()]
+        superseded += len(batch) - len(new)
+        if len(new):
+            lines.append(journal_line(kind, new, dataset.source))
+            carried += len(new)
+    if superseded:
+        INGEST_DROPPED.labels('in_workbooks').inc(superseded)
+    return lines, carried, superseded
+
+
+def rotate_journal(dataset):
+    # Make sure the journal belongs to the dataset's workbooks
+    with open(INGEST_JOURNAL, 'a+b') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        first = f.readline()
+        if journal_source(first) == dataset.source:
+            return
+        lines, carried, superseded = carry_journal(f, dataset)
+        # Writers blocked on the old file find it replaced and reopen; the
+        # archive is a second link to it
+        archive = None
+        if first:
+            archive = f"{INGEST_JOURNAL}.{time.strftime('%Y%m%d%H%M%S')}"
+            os.link(INGEST_JOURNAL, archive)
+        with open(INGEST_JOURNAL + '.new', 'w', encoding='utf-8') as new:
+            new.write(f'{{"source": {json.dumps(dataset.source)}}}\n')
+            new.writelines(lines)
+        os.replace(INGEST_JOURNAL + '.new', INGEST_JOURNAL)
+    if archive:
+        app.logger.info("Workbooks changed: ingest journal moved to %s, %d ingested rows carried over, "
+                        "%d now in the workbooks", archive, carried, superseded)
+
+
+def apply_journal(dataset):
+    entries, offset = read_journal(dataset.journal_offset)
+    if offset == dataset.journal_offset:
+        return dataset
+    batches = {'trips': [], 'closures': []}
+    templates = {'trips': dataset.df, 'closures': dataset.closure_df}
+    for entry in entries:
+        if not isinstance(entry, dict) or 'kind' not in entry:
+            # The journal's first line (rotate_journal)
+            continue
+        rows = entry.get('rows')
+        if entry.get('source') != dataset.source:
+            # Ingested on other workbooks (append_journal refuses those)
+            INGEST_DROPPED.labels('other_workbooks').inc(len(rows) if isinstance(rows, list) else 1)
+            app.logger.warning("Skipping ingest journal entry for workbooks %s", entry.get('source'))
+            continue
+        try:
+            batches[entry['kind']].append(validate_batch(
+                pd.DataFrame.from_records(rows), templates[entry['kind']], dataset.df.columns))
+        except (KeyError, TypeError, ValueError) as e:
+            INGEST_DROPPED.labels('invalid').inc(len(rows) if isinstance(rows, list) else 1)
+            app.logger.warning("Skipping ingest journal entry: %s", e)
+    trips, closures = (pd.concat(batches[k], ignore_index=True) if batches[k] else None for k in ('trips', 'closures'))
+    if trips is None and closures is None:
+        # Only lines to skip: the same data keeps its version
+        fresh = copy.copy(dataset)
+        fresh.partitions = {email: copy.copy(part) for email, part in dataset.partitions.items()}
+        for part in [fresh, *fresh.partitions.values()]:
+            part.journal_offset = offset
+        return fresh
+    # Same workbooks and journal give the same version in every process
+    version = hashlib.sha1(f"{dataset.base}:{offset}".encode()).hexdigest()[:12]
+    with timed('load.journal'):
+        fresh = dataset.extended(version, offset, trips, closures)
+    return partition_by_owner(fresh, dataset.owners, previous=dataset)
+
+
+def load_dataset():
+    with timed('load.total'):
+        source, version = source_version()
+        dataset = Dataset(version, load_frame(fleet_file), load_frame(closure_file))
+        dataset.source = source
+        rotate_journal(dataset)
+        return apply_journal(partition_by_owner(dataset, load_owners()))
+
+
+def record_dataset(dataset):
+    for name, frame in (('df', dataset.df), ('closure_df', dataset.closure_df), ('cube', dataset.cube)):
+        DATASET_ROWS.labels(name).set(len(frame))
+        DATASET_BYTES.labels(name).set(int(frame.memory_usage(index=True, deep=True).sum()))
+
+
+# Loaded by create_app(), not at import time. Until the first load finishes
+# the server is up but not ready: data routes answer 503 (see warm_up_gate).
+_dataset = None
+_reload_lock = threading.Lock()
+_failed_version = None
+# Stat of the sources the loaded dataset came from (see source_stamp)
+_source_stamp = None
+_watcher_started = False
+# Set in the process that follows the workbooks (see start_data_watcher)
+_publishing = False
+_loader_started = False
+_load_error = None
+_loaded_at = None
+_ready = threading.Event()
+# Notified after every load attempt, failed or not
+_load_attempted = threading.Condition()
+
+
+def current_dataset():
+    # Pin one snapshot per request so a reload mid-request is never observed;
+    # owner accounts (and anonymous requests) get their partition of it
+    if 'dataset' not in g:
+        user = session.get('user') or {}
+        g.dataset = _dataset if user.get('role', 'Owner') != 'Owner' else _dataset.for_owner(user.get('email'))
+    return g.dataset
+
+
+def reload_dataset():
+    global _dataset, _failed_version, _source_stamp
+    with _reload_lock:
+        if _dataset is None:
+            # Still loading (or the first load failed): the loader owns it
+            return False
+        # Only the publishing process loads new workbooks; it rolls the
+        # others onto them
+        stamp = source_stamp() if _publishing else _source_stamp
+        fresh = None
+        if stamp not in (_source_stamp, _failed_version):
+            try:
+                # Sources touched or re-saved unchanged keep the loaded data
+                if source_version()[1] != _dataset.base:
+                    fresh = load_dataset()
+                _source_stamp = stamp
+            except Exception:
+                _failed_version = stamp
+                app.logger.exception("Reloading trip data failed, keeping version %s", _dataset.version)
+                return False
+        if fresh is None:
+            # Workbooks unchanged: merge only newly journalled batches
+            try:
+                fresh = apply_journal(_dataset)
+            except Exception:
+                app.logger.exception("Applying ingested batches failed, keeping version %s", _dataset.version)
+                return False
+            if fresh.version == _dataset.version:
+                _dataset = fresh
+                return False
+        old, _dataset = _dataset, fresh
+        record_dataset(fresh)
+        result_cache.clear(keep_version=fresh.version)
+        app.logger.info("Trip data reloaded: version %s", fresh.version)
+        # The publishing process speaks for all of them (see LiveFeed)
+        if _publishing:
+            publish_changes(old, fresh)
+        return True
+
+
+def watch_sources(on_reload=None):
+    while True:
+        time.sleep(RELOAD_INTERVAL)
+        try:
+            base = _dataset.base if _dataset is not None else None
+            if reload_dataset() and on_reload and _dataset.base != base:
+                on_reload()
+        except OSError:
+            app.logger.exception("Checking trip data sources failed")
+
+
+def start_data_watcher(on_reload=None, sources=True):
+    # sources=True: this process follows the workbooks as well as the ingest
+    # journal and publishes every change (the gunicorn master, or the only
+    # process); on_reload runs after it loads new workbooks or owners. sources=False
+    # follows only the journal, applying new batches in-process (gunicorn
+    # workers, which the master rolls onto new workbooks).
+    global _watcher_started, _publishing
+    if RELOAD_INTERVAL > 0 and not _watcher_started:
+        _watcher_started = True
+        _publishing = sources
+        threading.Thread(target=watch_sources, args=(on_reload,), name='data-watcher', daemon=True).start()
+
+
+def load_initial_dataset():
+    # A missing or unreadable workbook must not take the server down: keep
+    # the error for /readyz and retry whenever the sources change
+    global _dataset, _load_error, _loaded_at, _source_stamp
+    failed = None
+    while True:
+        stamp = None
+        try:
+            stamp = source_stamp()
+            if stamp != failed:
+                fresh = load_dataset()
+                break
+        except Exception as e:
+            failed = stamp
+            error = f"{type(e).__name__}: {e}"
+            if error != _load_error:
+                app.logger.exception("Loading trip data failed; retrying when the sources change")
+            with _load_attempted:
+                _load_error = error
+                _load_attempted.notify_all()
+        time.sleep(max(RELOAD_INTERVAL, 1))
+    with _reload_lock, _load_attempted:
+        _dataset, _source_stamp = fresh, stamp
+        record_dataset(fresh)
+        _load_error = None
+        _loaded_at = time.time()
+        _ready.set()
+        _load_attempted.notify_all()
+    app.logger.info("Trip data loaded: version %s", fresh.version)
+
+
+def start_data_loader():
+    global _loader_started
+    if _dataset is None and not _loader_started:
+        _loader_started = True
+        threading.Thread(target=load_initial_dataset, name='data-loader', daemon=True).start()
+
+
+def wait_until_ready(timeout=None, retrying=False):
+    # True once the first load has finished, False if timeout passes first.
+    # A failed attempt raises its error, as the loader retries only when the
+    # sources change; retrying=True waits for that retry instead.
+    if retrying:
+        return _ready.wait(timeout)
+    with _load_attempted:
+        _load_attempted.wait_for(lambda: _ready.is_set() or _load_error is not None, timeout)
+        if not _ready.is_set() and _load_error is not None:
+            raise RuntimeError(f"Loading trip data failed: {_load_error}")
+    return _ready.is_set()
+
+
+# Live updates. The process that watches the sources (the gunicorn master, or
+# the only process) appends what each reload changed to a JSON-lines event
+# log: the status transitions and the cube delta. Every worker runs one
+# producer thread that follows the log, applies the delta to its own copy of
+# the cube, computes each subscribed view's KPI and chart changes once, and
+# fans the encoded event out to that view's Server-Sent Events subscribers.
+EVENT_LOG = os.environ.get('EVENT_LOG', os.path.join('/tmp', 'fleet_events.jsonl'))
+EVENT_LOG_KEEP = 50
+EVENT_MAX_TRANSITIONS = 500
+EVENT_MAX_DELTA_CELLS = 20000
+EVENT_POLL_INTERVAL = 1
+EVENT_KEEPALIVE = 15
+EVENT_QUEUE_SIZE = 64
+EVENT_RETRY_MS = 5000
+LIVE_KPIS = ['total_trips', 'ongoing', 'closed', 'flags', 'resolved',
+             'rev_m', 'exp_m', 'profit_m', 'kms_k', 'per_km', 'profit_pct']
+
+
+def status_codes(frame, statuses):
+    return pd.Categorical(frame['Trip Status'], categories=statuses).codes
+
+
+def transition_records(frame, positions, before, after, statuses):
+    rows = frame.iloc[positions]
+    dates = rows['Trip Date'].dt.strftime('%Y-%m-%d')
+    routes = rows['Route'] if 'Route' in rows.columns else pd.Series(None, index=rows.index)
+    return [{'trip_id': trip_id, 'date': None if pd.isna(date) else date,
+             'vehicle': None if pd.isna(vehicle) else vehicle, 'route': None if pd.isna(route) else route,
+             'from': statuses[a] if a >= 0 else None, 'to': statuses[b] if b >= 0 else None}
+            for trip_id, date, vehicle, route, a, b in zip(rows['Trip ID'], dates, rows['Vehicle ID'], routes,
+                                                           before, after)]
+
+
+def status_transitions(old, new, limit):
+    # Trips whose status changed, that appeared or that went away, paired by
+    # Trip ID through the old snapshot's hash index. Returns at most limit
+    # records and the full count.
+    old_ids, old_first = first_rows(old.trip_ids)
+    new_ids, new_first = first_rows(new.trip_ids)
+    statuses = pd.Index(old.df['Trip Status'].dropna().unique().tolist()).union(
+        new.df['Trip Status'].dropna().unique().tolist())
+    before = status_codes(old.df, statuses)[old_first]
+    after = status_codes(new.df, statuses)[new_first]
+    hit = old_ids.get_indexer(new_ids)
+    found = np.zeros(len(old_ids), dtype=bool)
+    found[hit[hit >= 0]] = True
+    # -2 marks a trip the old snapshot did not have (-1 is a missing status)
+    was = np.where(hit >= 0, before[np.maximum(hit, 0)], -2)
+    changed, gone = np.flatnonzero(was != after), np.flatnonzero(~found)
+    records = transition_records(new.df, new_first[changed[:limit]], was[changed[:limit]],
+                                 after[changed[:limit]], statuses)
+    rest = max(limit - len(records), 0)
+    records += transition_records(old.df, old_first[gone[:rest]], before[gone[:rest]],
+                                  np.full(len(gone[:rest]), -1), statuses)
+    return records, len(changed) + len(gone)
+
+
+def cube_delta(old, new):
+    # Cells whose measures changed, as signed differences (new minus old)
+    keys = [k for k in CUBE_KEYS if k in new.columns] + ['Date']
+    old, new = align_categories(old[keys + CUBE_MEASURES], new[keys + CUBE_MEASURES])
+    both = pd.concat([new, old.assign(**{m: -old[m] for m in CUBE_MEASURES})], ignore_index=True)
+    delta = both.groupby(keys, dropna=False, sort=True)[CUBE_MEASURES].sum().reset_index()
+    delta = delta[(delta[CUBE_MEASURES] != 0).any(axis=1)]
+    return delta.sort_values('Date', kind='stable', na_position='last', ignore_index=True)
+
+
+def encode_delta(delta):
+    delta = delta.assign(Date=delta['Date'].dt.strftime('%Y-%m-%d'))
+    return {'columns': list(delta.columns),
+            'data': delta.astype(object).where(delta.notna(), None).to_numpy().tolist()}
+
+
+def decode_delta(data, like):
+    delta = pd.DataFrame(data['data'], columns=data['columns'])
+    delta['Date'] = pd.to_datetime(delta['Date']).astype(like['Date'].dtype)
+    return delta
+
+
+def append_event(entry):
+    # Sequence numbers order the entries; the log keeps the last
+    # EVENT_LOG_KEEP of them once it has grown to twice that
+    with open(EVENT_LOG, 'a+', encoding='utf-8') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        lines = f.read().splitlines()
+        entry['seq'] = json.loads(lines[-1])['seq'] + 1 if lines else 1
+        line = json.dumps(entry, default=str)
+        if len(lines) + 1 < 2 * EVENT_LOG_KEEP:
+            f.write(line + '\n')
+            return
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(EVENT_LOG)))
+        with os.fdopen(fd, 'w', encoding='utf-8') as out:
+            out.write('\n'.join(lines[-EVENT_LOG_KEEP + 1:] + [line]) + '\n')
+        os.replace(tmp, EVENT_LOG)
+
+
+def publish_changes(old, new):
+    # A delta too large to ship, or a new owner mapping, makes subscribers
+    # reload instead
+    try:
+        with timed('events.publish'):
+            transitions, count = status_transitions(old, new, EVENT_MAX_TRANSITIONS)
+            delta = cube_delta(old.cube, new.cube)
+            append_event({'from': old.version, 'to': new.version, 'time': time.time(),
+                          'source': new.source, 'offset': new.journal_offset,
+                          'transitions': transitions, 'transition_count': count,
+                          'truncated': count > len(transitions),
+                          'cube': encode_delta(delta) if len(delta) <= EVENT_MAX_DELTA_CELLS
+                          and old.owners == new.owners else None})
+    except Exception:
+        app.logger.exception("Publishing the changes of version %s failed", new.version)
+
+
+def live_view(cube, key):
+    # The dashboard numbers the stream keeps current, summarized off the
+    # cube; scope is the vehicles of the owner whose partition the page shows
+    scope, vehicle, route, start, end, bucket = key
+    part = cube if scope is None else cube[cube['Vehicle ID'].isin(scope)]
+    dates = part.loc[part['rows'].to_numpy() != 0, 'Date']
+    first, last = dates.min(), dates.max()
+    if vehicle:
+        part = part[part['Vehicle ID'] == vehicle]
+    if route:
+        part = part[part['Route'] == route] if 'Route' in part.columns else part.iloc[0:0]
+    part = slice_dates(part, start, end)
+    _, axis = bucket_axis(start if start is not None else first, end if end is not None else last, bucket)
+    m = summarize_cube(part, axis)
+    return {'kpis': {k: m[k] for k in LIVE_KPIS}, 'labels': m['labels'],
+            'points': list(zip(m['daily'], m['audited'], m['audit_pct'])), 'bar_values': m['bar_values']}
+
+
+def view_delta(old, new):
+    # Only the KPIs, chart points (by label) and bars that changed
+    old = old or {'kpis': {}, 'labels': None, 'points': [], 'bar_values': None}
+    delta = {'kpis': {k: v for k, v in new['kpis'].items() if old['kpis'].get(k) != v}}
+    if new['labels'] != old['labels']:
+        delta['labels'] = new['labels']
+    old_points = dict(zip(old['labels'] or [], old['points']))
+    delta['points'] = [[i, *p] for i, (label, p) in enumerate(zip(new['labels'], new['points']))
+                       if old_points.get(label) != p]
+    if new['bar_values'] != old['bar_values']:
+        delta['bar_values'] = new['bar_values']
+    return delta
+
+
+def view_transitions(key, entries):
+    scope, vehicle, route, start, end, _ = key
+    lo = start.strftime('%Y-%m-%d') if start is not None else None
+    hi = end.strftime('%Y-%m-%d') if end is not None else None
+    return [t for entry in entries for t in entry['transitions']
+            if (scope is None or t['vehicle'] in scope)
+            and (not vehicle or t['vehicle'] == vehicle) and (not route or t['route'] == route)
+            and (lo is None or (t['date'] or '') >= lo) and (hi is None or (t['date'] or '9') <= hi)]
+
+
+def sse_message(event, event_id, data):
+    return f"event: {event}\nid: {event_id}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class LiveFeed:
+    # One per worker. The producer thread starts with the first subscriber;
+    # subscribers of the same view share one computed and encoded event.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.views = {}
+        self.history = deque(maxlen=EVENT_LOG_KEEP)
+        self.version = self.cube = self.thread = None
+        # The workbooks and journal offset of the version followed
+        self.source, self.offset = None, 0
+        self.seq = 0
+        self.stamp = None
+
+    def subscribe(self, key, since=None):
+        subscriber = queue.Queue(EVENT_QUEUE_SIZE)
+        with self.lock:
+            if self.thread is None:
+                self.version = _dataset.version
+                self.cube = _dataset.cube
+                self.source, self.offset = _dataset.source, _dataset.journal_offset
+                for entry in self.read_log(since=_dataset.built):
+                    self.apply(entry)
+                self.thread = threading.Thread(target=self.run, name='live-feed', daemon=True)
+                self.thread.start()
+            if self.cube is not None and key not in self.views:
+                self.views[key] = live_view(self.cube, key)
+            self.subscribers.setdefault(key, set()).add(subscriber)
+            if since and since != self.version and self.cube is not None:
+                # Reconnected after missing an update: the whole view, and the
+                # transitions if the log still links the two versions
+                chain = self.chain(since)
+                subscriber.put(sse_message('update', self.version, dict(
+                    view_delta(None, self.views[key]), version=self.version,
+                    transitions=view_transitions(key, chain or []),
+                    truncated=chain is None or any(e['truncated'] for e in chain))))
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            for key, subscribers in list(self.subscribers.items()):
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.subscribers[key]
+                    self.views.pop(key, None)
+
+    def chain(self, since):
+        # Entries leading from version since to the current one, or None
+        entries, at = [], self.version
+        for entry in reversed(self.history):
+            if at == since:
+                break
+            if entry['to'] == at:
+                entries.append(entry)
+                at = entry['from']
+        return entries[::-1] if at == since else None
+
+    def end(self, subscriber):
+        for subscribers in self.subscribers.values():
+            subscribers.discard(subscriber)
+        try:
+            subscriber.put_nowait(None)
+        except queue.Full:
+            while not subscriber.empty():
+                subscriber.get_nowait()
+            subscriber.put_nowait(None)
+
+    def send(self, subscriber, message):
+        try:
+            subscriber.put_nowait(message)
+        except queue.Full:
+            # A client this far behind reconnects and catches up instead
+            self.end(subscriber)
+
+    def close(self):
+        # The worker is stopping (usually rolled after a reload): deliver what
+        # the log has, then end every stream so clients reconnect elsewhere
+        with self.lock:
+            if self.thread is not None:
+                self.catch_up()
+            for subscribers in list(self.subscribers.values()):
+                for subscriber in list(subscribers):
+                    self.end(subscriber)
+
+    def broadcast(self, message):
+        for subscribers in list(self.subscribers.values()):
+            for subscriber in list(subscribers):
+                self.send(subscriber, message)
+
+    def read_log(self, since=None):
+        try:
+            st = os.stat(EVENT_LOG)
+        except FileNotFoundError:
+            return []
+        stamp = (st.st_ino, st.st_size, st.st_mtime_ns)
+        if stamp == self.stamp:
+            return []
+        self.stamp = stamp
+        with open(EVENT_LOG, encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        if entries and entries[-1]['seq'] < self.seq:
+            # The log was started over
+            self.seq = 0
+        entries = [e for e in entries if e['seq'] > self.seq]
+        if entries:
+            self.seq = entries[-1]['seq']
+        if since is not None:
+            # Starting up: what was published before this snapshot was built
+            # is already in it (a worker forked just before a roll is not)
+            self.history.extend(dict(e, cube=None) for e in entries if e['time'] <= since)
+            return [e for e in entries if e['time'] > since]
+        return entries
+
+    def apply(self, entry):
+        self.history.append(dict(entry, cube=None))
+        if entry['to'] == self.version:
+            return
+        if entry.get('source') == self.source and entry.get('offset', 0) <= self.offset:
+            # Batches this worker had already applied in-process when the
+            # feed started
+            return
+        self.source, self.offset = entry.get('source'), entry.get('offset', 0)
+        if entry['from'] != self.version or self.cube is None or entry['cube'] is None:
+            # No delta to follow from this snapshot: clients reload the page
+            self.version = entry['to']
+            self.cube = None
+            self.views.clear()
+            self.broadcast(sse_message('reset', self.version, {'version': self.version}))
+            return
+        delta = decode_delta(entry['cube'], self.cube)
+        self.version = entry['to']
+        if len(delta):
+            self.cube = merge_cube(self.cube, delta)[0]
+        for key, subscribers in self.subscribers.items():
+            view = live_view(self.cube, key)
+            changes = view_delta(self.views.get(key), view)
+            transitions = view_transitions(key, [entry])
+            self.views[key] = view
+            if not transitions and not any(changes.values()):
+                continue
+            message = sse_message('update', self.version, dict(
+                changes, version=self.version, transitions=transitions, truncated=entry['truncated']))
+            for subscriber in list(subscribers):
+                self.send(subscriber, message)
+
+    def catch_up(self):
+        try:
+            entries = self.read_log()
+        except (OSError, ValueError):
+            app.logger.exception("Reading the event log failed")
+            return
+        if self.cube is None and _dataset is not None and _dataset.version == self.version:
+            self.cube = _dataset.cube
+        with timed('events.fanout'):
+            for entry in entries:
+                self.apply(entry)
+
+    def run(self):
+        keepalive = time.monotonic()
+        while True:
+            time.sleep(EVENT_POLL_INTERVAL)
+            with self.lock:
+                self.catch_up()
+                if time.monotonic() - keepalive >= EVENT_KEEPALIVE:
+                    keepalive = time.monotonic()
+                    self.broadcast(': keep-alive\n\n')
+
+
+live_feed = LiveFeed()
+
+
+# Computed view results (dashboard metrics, stats/finance series, reports) are
+# kept in a bounded LRU with a TTL. Keys always include the data version, and
+# the cache is cleared on reload. Setting RESULT_CACHE_DIR adds a shared
+# on-disk layer so worker processes reuse each other's results.
+class ResultCache:
+    def __init__(self, max_entries=256, ttl=300, shared_dir=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared_dir = shared_dir
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def get(self, key, compute):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                CACHE_LOOKUPS.labels('result', 'hit').inc()
+                return entry[1]
+        value = self._shared_get(key)
+        if value is not None:
+            with self.lock:
+                self.shared_hits += 1
+            CACHE_LOOKUPS.labels('result', 'shared_hit').inc()
+        else:
+            with self.lock:
+                self.misses += 1
+            CACHE_LOOKUPS.labels('result', 'miss').inc()
+            value = compute()
+            self._shared_put(key, value)
+        with self.lock:
+            self.entries[key] = (now + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self, keep_version=None):
+        with self.lock:
+            self.entries.clear()
+        if self.shared_dir and keep_version:
+            for path in glob.glob(os.path.join(self.shared_dir, '*.pickle')):
+                if not os.path.basename(path).startswith(keep_version + '-'):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {'entries': len(self.entries), 'max_entries': self.max_entries, 'ttl': self.ttl,
+                    'hits': self.hits, 'shared_hits': self.shared_hits, 'misses': self.misses,
+                    'hit_rate': round((self.hits + self.shared_hits) / lookups, 3) if lookups else 0,
+                    'shared': bool(self.shared_dir)}
+
+    def _shared_path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.shared_dir, f"{key[1]}-{digest}.pickle")
+
+    def _shared_get(self, key):
+        if not self.shared_dir:
+            return None
+        path = self._shared_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            return None
+
+    def _shared_put(self, key, value):
+        if not self.shared_dir:
+            return
+        path = self._shared_path(key)
+        try:
+            os.makedirs(self.shared_dir, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except Exception:
+            app.logger.exception("Writing shared result cache entry failed")
+
+
+result_cache = ResultCache(
+    max_entries=int(os.environ.get('RESULT_CACHE_SIZE', '256')),
+    ttl=float(os.environ.get('RESULT_CACHE_TTL', '300')),
+    shared_dir=os.environ.get('RESULT_CACHE_DIR') or None)
+
+
+def cached_result(view, dataset, compute, *params):
+    # Cached values are shared between requests: callers must not mutate them
+    return result_cache.get((view, dataset.version, dataset.owner) + params, compute)
+
+
+@app.after_request
+def add_data_version(response):
+    if 'dataset' in g:
+        response.headers['X-Data-Version'] = g.dataset.version
+    return response
+
+
+# Users live in SQLite (WAL mode, unique index on email), shared safely by
+# every worker process. USER_FILE is the legacy JSON store, imported once.
 USER_FILE = os.path.join('/tmp', 'users.json')
-
-
-# Load users from file if exists
-if os.path.exists(USER_FILE):
+USER_DB = os.environ.get('USER_DB', os.path.join('/tmp', 'users.db'))
+_db_local = threading.local()
+
+
+def user_db():
+    # One connection per thread, reopened after a fork
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None or _db_local.pid != os.getpid():
+        conn = sqlite3.connect(USER_DB, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _db_local.conn, _db_local.pid = conn, os.getpid()
+    return conn
+
+
+def init_user_db():
+    conn = user_db()
+    conn.execute('PRAGMA journal_mode=WAL')
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL)''')
+        conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS users_email ON users (email)')
+        conn.execute('''CREATE TABLE IF NOT EXISTS sessions (
+            token TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires REAL NOT NULL)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL,
+            version TEXT NOT NULL,
+            source TEXT NOT NULL,
+            journal_offset INTEGER NOT NULL,
+            owner TEXT,
+            filename TEXT NOT NULL,
+            status TEXT NOT NULL,
+            progress REAL NOT NULL DEFAULT 0,
+            pid INTEGER,
+            path TEXT,
+            size INTEGER,
+            error TEXT,
+            created REAL NOT NULL,
+            finished REAL)''')
+    migrate_json_users(conn)
+
+
+def migrate_json_users(conn):
+    if not os.path.exists(USER_FILE):
+        return
     with open(USER_FILE, 'r') as f:
-        users = json.load(f)
-else:
-    users = []
+        legacy = json.load(f)
+    with conn:
+        conn.executemany('INSERT OR IGNORE INTO users (name, email, password, role) VALUES (?, ?, ?, ?)',
+                         [(u['name'], u['email'], u['password'], u.get('role', 'Owner')) for u in legacy])
+    try:
+        os.replace(USER_FILE, USER_FILE + '.migrated')
+    except FileNotFoundError:
+        pass  # another worker finished the migration first
+    app.logger.info("Migrated %d users from %s", len(legacy), USER_FILE)
+
+
+def get_user(email):
+    row = user_db().execute('SELECT name, email, password, role FROM users WHERE email = ?', (email,)).fetchone()
+    return dict(row) if row else None
+
+
+def create_user(name, email, password_hash, role='Owner'):
+    try:
+        with user_db() as conn:
+            conn.execute('INSERT INTO users (name, email, password, role) VALUES (?, ?, ?, ?)',
+                         (name, email, password_hash, role))
+    except sqlite3.IntegrityError:
+        return False
+    return True
+
+
+# Server-side sessions: the cookie only carries an opaque random token. The
+# small session record lives in the sessions table, fronted by a short-lived
+# per-process cache, so every worker sees the same logins. Logging in or out
+# replaces the token, and deleting a session appends a byte to
+# SESSION_REVOKED: a process that sees the file change drops its cached
+# sessions, so a logout takes effect in every worker at once.
+SESSION_CACHE_TTL = 30
+SESSION_REVOKED = os.environ.get('SESSION_REVOKED', USER_DB + '.revoked')
+_session_cache = {}
+_session_cache_lock = threading.Lock()
+_session_revoked = None
+_last_session_purge = 0
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, token=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.token = token
+        # The login the token was issued for
+        self.user = self.get('user')
+        self.modified = False
+
+
+def revocation_mark():
+    try:
+        st = os.stat(SESSION_REVOKED)
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def load_session(token):
+    global _session_revoked
+    now = time.time()
+    mark = revocation_mark()
+    with _session_cache_lock:
+        if mark != _session_revoked:
+            _session_cache.clear()
+            _session_revoked = mark
+        cached = _session_cache.get(token)
+    if cached and cached[0] > now:
+        CACHE_LOOKUPS.labels('session', 'hit').inc()
+        return cached[1]
+    CACHE_LOOKUPS.labels('session', 'miss').inc()
+    row = user_db().execute('SELECT data, expires FROM sessions WHERE token = ?', (token,)).fetchone()
+    if row is None or row['expires'] < now:
+        return None
+    data = json.loads(row['data'])
+    with _session_cache_lock:
+        if len(_session_cache) > 10000:
+            _session_cache.clear()
+        _session_cache[token] = (min(now + SESSION_CACHE_TTL, row['expires']), data)
+    return data
+
+
+def store_session(token, data, expires):
+    global _last_session_purge
+    now = time.time()
+    with user_db() as conn:
+        conn.execute('INSERT OR REPLACE INTO sessions (token, data, expires) VALUES (?, ?, ?)',
+                     (token, json.dumps(data), expires))
+        if now - _last_session_purge > 60:
+            conn.execute('DELETE FROM sessions WHERE expires < ?', (now,))
+            _last_session_purge = now
+    with _session_cache_lock:
+        _session_cache[token] = (min(now + SESSION_CACHE_TTL, expires), data)
+
+
+def delete_session(token):
+    with user_db() as conn:
+        conn.execute('DELETE FROM sessions WHERE token = ?', (token,))
+    with _session_cache_lock:
+        _session_cache.pop(token, None)
+    with open(SESSION_REVOKED, 'a') as f:
+        if f.tell() >= 4096:
+            f.truncate(0)
+        f.write('\n')
+
+
+class SqliteSessionInterface(SessionInterface):
+    def open_session(self, app, request):
+        token = request.cookies.get(self.get_cookie_name(app))
+        if token:
+            data = load_session(token)
+            if data is not None:
+                return ServerSession(data, token=token)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.token and session.get('user') != session.user:
+            # Logged in or out: the old token must not carry the new login
+            # (or outlive the old one)
+            delete_session(session.token)
+            session.token = None
+            if not session:
+                response.delete_cookie(name, domain=domain, path=path)
+                return
+        if not session:
+            if session.token and session.modified:
+                delete_session(session.token)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+        token = session.token or secrets.token_urlsafe(24)
+        store_session(token, dict(session), time.time() + app.permanent_session_lifetime.total_seconds())
+        response.set_cookie(name, token, expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+
+app.session_interface = SqliteSessionInterface()
+
+
+# Page assets (the purged stylesheet and Chart.js) are built by
+# tools/build_assets.py into static/ under content-hashed names, with gzip and
+# brotli variants beside them. A hashed name never changes content, so
+# browsers may cache it for good.
+STATIC_DIR = os.path.join(app.root_path, 'static')
+STATIC_MAX_AGE = 365 * 24 * 3600
+PRECOMPRESSED = [('br', '.br'), ('gzip', '.gz')]
+
+
+def load_manifest():
+    with open(os.path.join(STATIC_DIR, 'manifest.json')) as f:
+        return json.load(f)
+
+
+ASSETS = load_manifest()
+HASHED_ASSETS = set(ASSETS.values())
+
+
+@app.template_global()
+def asset_url(name):
+    return url_for('static', filename=ASSETS[name])
+
+
+@app.route('/static/<path:filename>', endpoint='static')
+def static_file(filename):
+    path = safe_join(STATIC_DIR, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    max_age = STATIC_MAX_AGE if filename in HASHED_ASSETS else None
+    for encoding, suffix in PRECOMPRESSED:
+        if request.accept_encodings[encoding] and os.path.isfile(path + suffix):
+            response = send_file(path + suffix, mimetype=mimetype, max_age=max_age)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_file(path, mimetype=mimetype, max_age=max_age)
+    response.vary.add('Accept-Encoding')
+    if max_age:
+        response.cache_control.immutable = True
+    return response
+
+
+# HTML and JSON responses are compressed for clients that accept it. Streamed
+# pages are flushed every COMPRESS_FLUSH_BYTES of input, so table rows still
+# render as they arrive.
+COMPRESS_MIMETYPES = {'text/html', 'application/json'}
+COMPRESS_MIN_BYTES = 500
+COMPRESS_FLUSH_BYTES = 16 * 1024
+
+
+def compressor(encoding):
+    # (compress, flush, finish) for one response body
+    if encoding == 'br':
+        c = brotli.Compressor(quality=5)
+        return c.process, c.flush, c.finish
+    c = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return c.compress, lambda: c.flush(zlib.Z_SYNC_FLUSH), c.flush
+
+
+def compress_stream(body, encoding):
+    compress, flush, finish = compressor(encoding)
+    pending = 0
+    try:
+        for chunk in body:
+            chunk = chunk.encode() if isinstance(chunk, str) else chunk
+            out = compress(chunk)
+            pending += len(chunk)
+            if pending >= COMPRESS_FLUSH_BYTES:
+                out += flush()
+                pending = 0
+            if out:
+                yield out
+        yield finish()
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+
+
+@app.after_request
+def compress_response(response):
+    if (response.mimetype not in COMPRESS_MIMETYPES or response.direct_passthrough
+            or response.status_code in (204, 206) or not 200 <= response.status_code < 300
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = next((e for e, _ in PRECOMPRESSED if request.accept_encodings[e]), None)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_BYTES:
+            return response
+        compress, _, finish = compressor(encoding)
+        response.set_data(compress(data) + finish())
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
 
 
 TEMPLATES = {
     'signup': '''
-    <html><head><title>Sign Up</title><script src="https://cdn.tailwindcss.com"></script></head>
+    <html><head><title>Sign Up</title><link rel="stylesheet" href="{{ asset_url('app.css') }}"></head>
     <body class="bg-[#0B132B] text-white flex justify-center items-center h-screen">
       <form method="POST" class="bg-[#0E1A36] p-8 rounded-xl space-y-4 w-96">
         <h1 class="text-2xl font-bold text-center">Sign Up</h1>
@@ -54,7 +2229,7 @@ TEMPLATES = {
     ''',
 
     'login': '''
-    <html><head><title>Login</title><script src="https://cdn.tailwindcss.com"></script></head>
+    <html><head><title>Login</title><link rel="stylesheet" href="{{ asset_url('app.css') }}"></head>
     <body class="bg-[#0B132B] text-white flex justify-center items-center h-screen">
       <form method="POST" class="bg-[#0E1A36] p-8 rounded-xl space-y-4 w-96">
         <h1 class="text-2xl font-bold text-center">Login</h1>
@@ -67,18 +2242,99 @@ TEMPLATES = {
     ''',
 
     'table_page': '''
-    <html><head><title>{{ title }}</title><script src="https://cdn.tailwindcss.com"></script></head>
+    <html><head><title>{{ title }}</title><link rel="stylesheet" href="{{ asset_url('app.css') }}"></head>
     <body class="bg-[#0B132B] text-white p-6">
-      <h2 class="text-2xl font-bold mb-4">{{ title }}</h2>
-      <div class="overflow-x-auto text-sm bg-[#1C2541] p-4 rounded">{{ table|safe }}</div>
+      <h2 class="text-2xl font-bold mb-4">{{ title }}</h2>{% if live %}
+      <div id="live-notice" class="bg-[#1C2541] p-4 rounded mb-4" hidden><span></span> <a href="" class="underline">Refresh</a></div>{% endif %}
+      <form method="get" class="flex gap-4 mb-4">
+        <input name="q" value="{{ q }}" placeholder="Search" class="text-black p-2 rounded">
+        <input type="hidden" name="sort" value="{{ sort }}">
+        <input type="hidden" name="size" value="{{ size }}">
+        <button class="bg-blue-600 hover:bg-blue-700 px-4 py-2 rounded">Search</button>
+      </form>
+      <div class="overflow-x-auto text-sm bg-[#1C2541] p-4 rounded">
+        <table border="1" class="dataframe text-white">
+          <thead>
+            <tr style="text-align: right;">
+              {% for col in columns %}<th><a href="{{ sort_urls[col] }}">{{ col }}</a></th>{% endfor %}
+            </tr>
+          </thead>
+          <tbody>
+            {% for row in rows %}
+            <tr>{% for value in row %}<td>{{ value }}</td>{% endfor %}</tr>
+            {% endfor %}
+          </tbody>
+        </table>
+      </div>
+      <div class="mt-4 flex gap-4 items-center">
+        <span>Rows {{ first }}-{{ last }} of {{ total }}</span>
+        {% if prev_url %}<a href="{{ prev_url }}" class="bg-[#1C2541] px-3 py-1 rounded">Previous</a>{% endif %}
+        {% if next_url %}<a href="{{ next_url }}" class="bg-[#1C2541] px-3 py-1 rounded">Next</a>{% endif %}
+        <a href="{{ json_url }}" class="underline">JSON</a>
+      </div>
+      <a href="{{ url_for('dashboard') }}" class="mt-4 inline-block bg-blue-500 px-4 py-2 rounded">Back</a>{% if live %}
+      <script>
+        // Live updates: count trips entering and leaving the listed status,
+        // and dim the rows on this page that left it
+        const status = {{ live|tojson }};
+        const notice = document.getElementById('live-notice');
+        let started = 0, ended = 0;
+        const connect = () => {
+          const events = new EventSource('{{ url_for('live_stream', since=version) }}');
+          events.addEventListener('update', e => {
+            const u = JSON.parse(e.data);
+            if (u.truncated) return window.location.reload();
+            const rows = new Map([...document.querySelectorAll('tbody tr')].map(r => [r.cells[0].textContent, r]));
+            u.transitions.forEach(t => {
+              if (t.to === status && t.from !== status) started++;
+              if (t.from === status && t.to !== status) {
+                ended++;
+                const row = rows.get(t.trip_id);
+                if (row) {
+                  row.style.opacity = 0.4;
+                  row.title = 'Now ' + (t.to || 'removed');
+                }
+              }
+            });
+            if (started || ended) {
+              notice.hidden = false;
+              notice.firstChild.textContent = `${started} trips became ${status} and ${ended} moved on since this page loaded.`;
+            }
+          });
+          events.addEventListener('reset', () => window.location.reload());
+          events.onerror = () => {
+            if (events.readyState === EventSource.CLOSED) setTimeout(connect, {{ retry_ms }});
+          };
+        };
+        connect();
+      </script>{% endif %}
+    </body></html>
+    ''',
+
+    'trip': '''
+    <html><head><title>Trip {{ trip_id }}</title><link rel="stylesheet" href="{{ asset_url('app.css') }}"></head>
+    <body class="bg-[#0B132B] text-white p-6">
+      <h2 class="text-2xl font-bold mb-4">Trip {{ trip_id }}</h2>
+      {% for note in notes %}<p class="mb-2">{{ note }}</p>{% endfor %}
+      <div class="overflow-x-auto text-sm bg-[#1C2541] p-4 rounded">
+        <table border="1" class="dataframe text-white">
+          <thead><tr><th>Field</th><th>Fleet</th><th>Closure</th></tr></thead>
+          <tbody>
+            {% for field, fleet, closure, differs in fields %}
+            <tr{% if differs %} class="bg-red-600"{% endif %}><td>{{ field }}</td><td>{{ fleet }}</td><td>{{ closure }}</td></tr>
+            {% endfor %}
+          </tbody>
+        </table>
+      </div>
+      <a href="{{ url_for('reconciliation') }}" class="mt-4 inline-block bg-blue-500 px-4 py-2 rounded">Reconciliation</a>
       <a href="{{ url_for('dashboard') }}" class="mt-4 inline-block bg-blue-500 px-4 py-2 rounded">Back</a>
     </body></html>
     ''',
 
     'dashboard': '''
     <html><head><title>Dashboard</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
+    <link rel="stylesheet" href="{{ asset_url('app.css') }}">
+    <script src="{{ asset_url('chart.js') }}"></script>
     </head>
     <body class="bg-[#0B132B] text-white p-6 font-sans">
       <h1 class="text-3xl font-bold mb-6">Fleet Owner Dashboard</h1>
@@ -96,36 +2352,52 @@ TEMPLATES = {
             <option value="{{ r }}" {% if r == selected_route %}selected{% endif %}>{{ r }}</option>
           {% endfor %}
         </select>
+        <select name="month" class="text-black p-2 rounded">
+          <option value="">All Months</option>
+          {% for mo in months %}
+            <option value="{{ mo }}" {% if mo == selected_month %}selected{% endif %}>{{ mo }}</option>
+          {% endfor %}
+        </select>
+        <input type="date" name="from" value="{{ date_from }}" class="text-black p-2 rounded">
+        <input type="date" name="to" value="{{ date_to }}" class="text-black p-2 rounded">
+        <select name="bucket" class="text-black p-2 rounded">
+          {% for b in ['auto', 'day', 'week', 'month', 'year'] %}
+            <option value="{{ b }}" {% if b == bucket %}selected{% endif %}>{{ b|capitalize }}</option>
+          {% endfor %}
+        </select>
         <button class="bg-blue-600 hover:bg-blue-700 px-4 py-2 rounded">Apply Filters</button>
       </form>
 
       <div class="grid grid-cols-3 gap-4 mb-6">
         <div class="bg-[#1C2541] p-4 rounded">
-          <p>Total Trips: <b>{{ total_trips }}</b></p>
-          <p>Ongoing: <b>{{ ongoing }}</b></p>
-          <p>Closed: <b>{{ closed }}</b></p>
-          <p>Flags: <b>{{ flags }}</b></p>
-          <p>Resolved: <b>{{ resolved }}</b></p>
+          <p>Total Trips: <b id="kpi-total_trips">{{ total_trips }}</b></p>
+          <p>Ongoing: <b id="kpi-ongoing">{{ ongoing }}</b></p>
+          <p>Closed: <b id="kpi-closed">{{ closed }}</b></p>
+          <p>Flags: <b id="kpi-flags">{{ flags }}</b></p>
+          <p>Resolved: <b id="kpi-resolved">{{ resolved }}</b></p>
+          <p>Rule Flags: <b>{{ rule_flags }}</b></p>
         </div>
         <div class="bg-[#1C2541] p-4 rounded">
           <p class="font-bold mb-2 text-lg">Financial Summary</p>
-          <p>Revenue: ₹{{ rev_m }}M</p>
-          <p>Expense: ₹{{ exp_m }}M</p>
-          <p>Profit: ₹{{ profit_m }}M</p>
-          <p>KMs: {{ kms_k }}K</p>
-          <p>Per KM: ₹{{ per_km }}</p>
-          <p>Profit %: {{ profit_pct }}%</p>
+          <p>Revenue: ₹<span id="kpi-rev_m">{{ rev_m }}</span>M</p>
+          <p>Expense: ₹<span id="kpi-exp_m">{{ exp_m }}</span>M</p>
+          <p>Profit: ₹<span id="kpi-profit_m">{{ profit_m }}</span>M</p>
+          <p>KMs: <span id="kpi-kms_k">{{ kms_k }}</span>K</p>
+          <p>Per KM: ₹<span id="kpi-per_km">{{ per_km }}</span></p>
+          <p>Profit %: <span id="kpi-profit_pct">{{ profit_pct }}</span>%</p>
         </div>
         <div class="bg-[#1C2541] p-4 rounded">
           <p class="font-bold mb-2">AI Report</p>
           <pre class="text-sm text-gray-300">{{ ai_report }}</pre>
-          <a href="/download-summary" class="mt-2 inline-block bg-green-600 px-3 py-1 rounded hover:bg-green-700">Download Summary</a>
+          <a href="{{ url_for('download_summary', **request.args) }}" class="mt-2 inline-block bg-green-600 px-3 py-1 rounded hover:bg-green-700">Download Summary</a>
+          <a href="{{ url_for('export_trips_csv', **request.args) }}" class="mt-2 inline-block bg-[#0B132B] px-3 py-1 rounded">CSV</a>
+          <a href="{{ url_for('export_trips_xlsx', **request.args) }}" class="mt-2 inline-block bg-[#0B132B] px-3 py-1 rounded">XLSX</a>
         </div>
       </div>
 
       <div class="grid grid-cols-2 gap-4">
         <div class="bg-[#1C2541] p-4 rounded">
-          <h2 class="mb-2 font-semibold text-lg">Daily Trips vs Audits</h2>
+          <h2 class="mb-2 font-semibold text-lg">{{ chart_bucket|capitalize }} Trips vs Audits</h2>
           <canvas id="auditChart" height="120"></canvas>
         </div>
         <div class="bg-[#1C2541] p-4 rounded">
@@ -141,216 +2413,98 @@ TEMPLATES = {
         <a href="/trip-ongoing" class="bg-purple-600 px-4 py-2 rounded">Ongoing Trips</a>
         <a href="/trip-stats" class="bg-pink-600 px-4 py-2 rounded">Trip Stats</a>
         <a href="/financial-dashboard" class="bg-orange-600 px-4 py-2 rounded">Financial Dashboard</a>
+        <a href="/reconciliation" class="bg-blue-500 px-4 py-2 rounded">Reconciliation</a>
         <a href="/logout" class="bg-red-600 px-4 py-2 rounded">Logout</a>
       </div>
 
       <script>
-        new Chart(document.getElementById('auditChart').getContext('2d'), {
-          data: {
-            labels: Array.from({length: 31}, (_, i) => i + 1),
-            datasets: [
-              {type: 'bar', label: 'Closed', data: {{ daily | safe }}, backgroundColor: '#4CAF50'},
-              {type: 'bar', label: 'Audited', data: {{ audited | safe }}, backgroundColor: '#2196F3'},
-              {type: 'line', label: 'Audit %', data: {{ audit_pct | safe }}, yAxisID: 'y1', borderColor: 'yellow', fill: false}
-            ]
-          },
-          options: {
-            responsive: true,
-            scales: {
-              y: {beginAtZero: true, ticks: {color: 'white'}, grid: {color: '#444'}},
-              y1: {beginAtZero: true, position: 'right', ticks: {color: 'white'}, grid: {drawOnChartArea: false}},
-              x: {ticks: {color: 'white'}, grid: {color: '#444'}}
-            },
-            plugins: {legend: {labels: {color: 'white'}}}
-          }
-        });
-
-        new Chart(document.getElementById('financeChart').getContext('2d'), {
-          type: 'bar',
-          data: {
-            labels: {{ bar_labels | safe }},
-            datasets: [{
-              label: '₹ in Millions',
-              data: {{ bar_values | safe }},
-              backgroundColor: ['#FFA500', '#FF4444', '#44FF44']
-            }]
-          },
-          options: {
-            plugins: {legend: {labels: {color: 'white'}}},
-            scales: {
-              y: {beginAtZero: true, ticks: {color: 'white'}},
-              x: {ticks: {color: 'white'}}
-            }
-          }
-        });
+        fetch('{{ url_for('api_dashboard') }}' + window.location.search)
+          .then(r => r.json())
+          .then(d => {
+            const auditChart = new Chart(document.getElementById('auditChart').getContext('2d'), {
+              data: {
+                labels: d.labels,
+                datasets: [
+                  {type: 'bar', label: 'Closed', data: d.daily, backgroundColor: '#4CAF50'},
+                  {type: 'bar', label: 'Audited', data: d.audited, backgroundColor: '#2196F3'},
+                  {type: 'line', label: 'Audit %', data: d.audit_pct, yAxisID: 'y1', borderColor: 'yellow', fill: false}
+                ]
+              },
+              options: {
+                responsive: true,
+                scales: {
+                  y: {beginAtZero: true, ticks: {color: 'white'}, grid: {color: '#444'}},
+                  y1: {beginAtZero: true, position: 'right', ticks: {color: 'white'}, grid: {drawOnChartArea: false}},
+                  x: {ticks: {color: 'white'}, grid: {color: '#444'}}
+                },
+                plugins: {legend: {labels: {color: 'white'}}}
+              }
+            });
+
+            const financeChart = new Chart(document.getElementById('financeChart').getContext('2d'), {
+              type: 'bar',
+              data: {
+                labels: d.bar_labels,
+                datasets: [{
+                  label: '₹ in Millions',
+                  data: d.bar_values,
+                  backgroundColor: ['#FFA500', '#FF4444', '#44FF44']
+                }]
+              },
+              options: {
+                plugins: {legend: {labels: {color: 'white'}}},
+                scales: {
+                  y: {beginAtZero: true, ticks: {color: 'white'}},
+                  x: {ticks: {color: 'white'}}
+                }
+              }
+            });
+
+            // Live updates: patch the KPIs and charts in place
+            const params = new URLSearchParams(window.location.search);
+            params.set('since', '{{ version }}');
+            const connect = () => {
+              const events = new EventSource('{{ url_for('live_stream') }}?' + params);
+              events.addEventListener('update', e => {
+                const u = JSON.parse(e.data);
+                for (const [k, v] of Object.entries(u.kpis)) {
+                  const el = document.getElementById('kpi-' + k);
+                  if (el) el.textContent = v;
+                }
+                const sets = auditChart.data.datasets;
+                if (u.labels) {
+                  auditChart.data.labels = u.labels;
+                  sets.forEach(s => s.data.length = u.labels.length);
+                }
+                u.points.forEach(([i, daily, audited, pct]) => {
+                  sets[0].data[i] = daily;
+                  sets[1].data[i] = audited;
+                  sets[2].data[i] = pct;
+                });
+                auditChart.update();
+                if (u.bar_values) {
+                  financeChart.data.datasets[0].data = u.bar_values;
+                  financeChart.update();
+                }
+              });
+              events.addEventListener('reset', () => window.location.reload());
+              events.onerror = () => {
+                if (events.readyState === EventSource.CLOSED) setTimeout(connect, {{ retry_ms }});
+              };
+            };
+            connect();
+          });
       </script>
     </body>
     </html>
-    '''
-}
-
-def generate_ai_report(filtered_df):
-    if filtered_df.empty:
-        return "No data available for AI report."
-    most_profitable_vehicle = filtered_df.groupby('Vehicle ID')['Net Profit'].sum().idxmax()
-    top_routes = ", ".join(filtered_df['Route'].value_counts().head(2).index) if 'Route' in filtered_df.columns else "N/A"
-    avg_profit_per_trip = round(filtered_df['Net Profit'].sum() / len(filtered_df), 2)
-    rev = filtered_df['Freight Amount'].sum()
-    exp = filtered_df['Total Trip Expense'].sum()
-    profit = filtered_df['Net Profit'].sum()
-    kms = filtered_df['Actual Distance (KM)'].sum()
-    profit_pct = round((profit / rev * 100), 1) if rev else 0
-    per_km = round(profit / kms, 2) if kms else 0
-    return f"""
-📊 AI Report Highlights:
-
-Total Trips: {len(filtered_df)}
-On-going Trips: {filtered_df[filtered_df['Trip Status'] == 'Pending Closure'].shape[0]}
-Completed Trips: {filtered_df[filtered_df['Trip Status'] == 'Completed'].shape[0]}
-Profit Percentage: {profit_pct}%
-
-Financials:
-- Revenue: ₹{round(rev / 1e6, 2)}M
-- Expense: ₹{round(exp / 1e6, 2)}M
-- Profit: ₹{round(profit / 1e6, 2)}M
-- KMs Travelled: {round(kms / 1e3, 1)}K
-- Cost per KM: ₹{per_km}
-
-AI Insights:
-- Top Vehicle: {most_profitable_vehicle}
-- Average Profit per Trip: ₹{avg_profit_per_trip}
-- Top Routes: {top_routes}
-"""
-
-@app.route('/')
-def home():
-    return redirect(url_for('signup'))
-
-@app.route('/signup', methods=['GET', 'POST'])
-def signup():
-    if request.method == 'POST':
-        # Check if user already exists
-        email = request.form['email']
-        if any(u['email'] == email for u in users):
-            return render_template_string(TEMPLATES['signup'], error="Email already registered!")
-
-        users.append({
-            'name': request.form['fullname'],
-            'email': email,
-            'password': generate_password_hash(request.form['password']),
-            'role': 'Owner'
-        })
-        # Save to file
-        with open(USER_FILE, 'w') as f:
-            json.dump(users, f)
-
-        return redirect(url_for('login'))
-
-    return render_template_string(TEMPLATES['signup'])
-
-
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    if request.method == 'POST':
-        user = next((u for u in users if u['email'] == request.form['email']), None)
-        if user and check_password_hash(user['password'], request.form['password']):
-            session['user'] = user
-            return redirect(url_for('dashboard'))
-        return 'Invalid credentials. <a href="' + url_for('login') + '">Try again</a>'
-    return render_template_string(TEMPLATES['login'])
-
-@app.route('/dashboard')
-def dashboard():
-    if 'user' not in session:
-        return redirect(url_for('login'))
-    vehicle = request.args.get('vehicle')
-    route = request.args.get('route')
-    filtered = df.copy()
-    if vehicle:
-        filtered = filtered[filtered['Vehicle ID'] == vehicle]
-    if route:
-        filtered = filtered[filtered['Route'] == route]
-
-    total_trips = len(filtered)
-    ongoing = filtered[filtered['Trip Status'] == 'Pending Closure'].shape[0]
-    closed = filtered[filtered['Trip Status'] == 'Completed'].shape[0]
-    flags = filtered[filtered['Trip Status'] == 'Under Audit'].shape[0]
-    resolved = filtered[(filtered['Trip Status'] == 'Under Audit') & (filtered['POD Status'] == 'Yes')].shape[0]
-
-    rev = filtered['Freight Amount'].sum()
-    exp = filtered['Total Trip Expense'].sum()
-    profit = filtered['Net Profit'].sum()
-    kms = filtered['Actual Distance (KM)'].sum()
-
-    rev_m = round(rev / 1e6, 2)
-    exp_m = round(exp / 1e6, 2)
-    profit_m = round(profit / 1e6, 2)
-    kms_k = round(kms / 1e3, 1)
-    per_km = round(profit / kms, 2) if kms else 0
-    profit_pct = round((profit / rev) * 100, 1) if rev else 0
-
-    daily = filtered.groupby('Day')['Trip ID'].count().reindex(range(1, 32), fill_value=0).tolist()
-    audited = filtered[filtered['Trip Status'] == 'Under Audit'].groupby('Day')['Trip ID'].count().reindex(range(1, 32), fill_value=0).tolist()
-    audit_pct = [round(a / b * 100, 1) if b else 0 for a, b in zip(audited, daily)]
-
-    bar_labels = ['Revenue', 'Expense', 'Profit']
-    bar_values = [float(rev_m), float(exp_m), float(profit_m)]
-    ai_report = generate_ai_report(filtered)
-
-    return render_template_string(TEMPLATES['dashboard'],
-        total_trips=total_trips, ongoing=ongoing, closed=closed,
-        flags=flags, resolved=resolved, rev_m=rev_m, exp_m=exp_m,
-        profit_m=profit_m, kms_k=kms_k, per_km=per_km, profit_pct=profit_pct,
-        ai_report=ai_report, vehicles=vehicles, routes=routes,
-        selected_vehicle=vehicle, selected_route=route,
-        daily=daily, audited=audited, audit_pct=audit_pct,
-        bar_labels=bar_labels, bar_values=bar_values)
-
-@app.route('/trip-generator')
-def trip_generator():
-    data = df[['Trip ID', 'Vehicle ID', 'Trip Status']]
-    return render_template_string(TEMPLATES['table_page'], title="Trip Generator", table=data.to_html(classes='text-white', index=False))
-
-@app.route('/trip-closure')
-def trip_closure():
-    data = df[df['Trip Status'] == 'Pending Closure'][['Trip ID', 'Vehicle ID', 'Trip Status']]
-    return render_template_string(TEMPLATES['table_page'], title="Trip Closure", table=data.to_html(classes='text-white', index=False))
-
-@app.route('/trip-auditor')
-def trip_auditor():
-    data = df[df['Trip Status'] == 'Under Audit'][['Trip ID', 'Vehicle ID', 'POD Status']]
-    return render_template_string(TEMPLATES['table_page'], title="Trip Auditor", table=data.to_html(classes='text-white', index=False))
-
-@app.route('/trip-ongoing')
-def trip_ongoing():
-    data = df[df['Trip Status'] == 'Pending Closure'][['Trip ID', 'Vehicle ID', 'Trip Status']]
-    return render_template_string(TEMPLATES['table_page'], title="Ongoing Trips", table=data.to_html(classes='text-white', index=False))
-
-import json  # make sure you have this import at the top if not already present
-
-@app.route('/trip-stats')
-def trip_stats():
-    days = list(range(1, 32))
-    total = df.groupby('Day')['Trip ID'].count().reindex(days, fill_value=0).tolist()
-    ongoing = df[df['Trip Status'] == 'Pending Closure'].groupby('Day')['Trip ID'].count().reindex(days, fill_value=0).tolist()
-    closed = df[df['Trip Status'] == 'Completed'].groupby('Day')['Trip ID'].count().reindex(days, fill_value=0).tolist()
-
-    # JSON serialize for safe embedding in JS
-    total_json = json.dumps(total)
-    ongoing_json = json.dumps(ongoing)
-    closed_json = json.dumps(closed)
-
-    # Sum totals to display numeric counts
-    total_sum = sum(total)
-    ongoing_sum = sum(ongoing)
-    closed_sum = sum(closed)
+    ''',
 
-    return render_template_string("""
+    'trip_stats': '''
     <!DOCTYPE html>
     <html>
     <head>
       <title>Trip Count Statistics</title>
-      <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
+      <script src="{{ asset_url('chart.js') }}"></script>
       <style>
         body {
           background-color: #0d1b2a;
@@ -386,11 +2540,24 @@ def trip_stats():
       <h2>Trip Count Statistics</h2>
 
       <div class="stats-summary">
-        <div>Total Trips: {{ total_sum }}</div>
-        <div>On-going Trips: {{ ongoing_sum }}</div>
-        <div>Trip Closed: {{ closed_sum }}</div>
+        <div>Total Trips: <span id="totalSum"></span></div>
+        <div>On-going Trips: <span id="ongoingSum"></span></div>
+        <div>Trip Closed: <span id="closedSum"></span></div>
       </div>
 
+      <form method="get" class="legend">
+        <label>From <input type="date" name="from" value="{{ request.args.get('from', '') }}"></label>
+        <label>To <input type="date" name="to" value="{{ request.args.get('to', '') }}"></label>
+        <label>Bucket
+          <select name="bucket">
+            {% for b in ['auto', 'day', 'week', 'month', 'year'] %}
+              <option value="{{ b }}" {% if b == request.args.get('bucket', 'auto') %}selected{% endif %}>{{ b|capitalize }}</option>
+            {% endfor %}
+          </select>
+        </label>
+        <button type="submit">Apply</button>
+      </form>
+
       <div class="legend">
         <label><input type="checkbox" id="totalCheckbox" checked> Total Trips</label>
         <label><input type="checkbox" id="ongoingCheckbox" checked> On-going Trips</label>
@@ -400,29 +2567,28 @@ def trip_stats():
 
       <script>
         const ctx = document.getElementById('tripChart').getContext('2d');
-        const labels = Array.from({ length: 31 }, (_, i) => i + 1);
 
         const datasets = [
           {
             label: 'Total Trips',
             backgroundColor: '#f5c518',
-            data: {{ total_data }},
+            data: [],
           },
           {
             label: 'On-going Trips',
             backgroundColor: '#00c896',
-            data: {{ ongoing_data }},
+            data: [],
           },
           {
             label: 'Trip Closed',
             backgroundColor: '#007bff',
-            data: {{ closed_data }},
+            data: [],
           }
         ];
 
         const config = {
           type: 'bar',
-          data: { labels: labels, datasets: datasets },
+          data: { labels: [], datasets: datasets },
           options: {
             responsive: true,
             scales: {
@@ -443,6 +2609,19 @@ def trip_stats():
 
         const tripChart = new Chart(ctx, config);
 
+        fetch('{{ url_for('api_trip_stats') }}' + window.location.search)
+          .then(r => r.json())
+          .then(d => {
+            document.getElementById('totalSum').textContent = d.total_sum;
+            document.getElementById('ongoingSum').textContent = d.ongoing_sum;
+            document.getElementById('closedSum').textContent = d.closed_sum;
+            tripChart.data.labels = d.labels;
+            datasets[0].data = d.total;
+            datasets[1].data = d.ongoing;
+            datasets[2].data = d.closed;
+            tripChart.update();
+          });
+
         // Checkbox toggling logic
         document.getElementById('totalCheckbox').addEventListener('change', function () {
           tripChart.data.datasets[0].hidden = !this.checked;
@@ -461,164 +2640,779 @@ def trip_stats():
       </script>
     </body>
     </html>
-    """,
-    total_data=total_json, ongoing_data=ongoing_json, closed_data=closed_json,
-    total_sum=total_sum, ongoing_sum=ongoing_sum, closed_sum=closed_sum)
+    ''',
 
+    'financial_dashboard': '''
+    <!DOCTYPE html>
+    <html lang="en">
+    <head>
+      <meta charset="UTF-8">
+      <title>Financial Dashboard</title>
+      <script src="{{ asset_url('chart.js') }}"></script>
+      <style>
+        body {
+          background-color: #0d1b2a;
+          font-family: Arial, sans-serif;
+          color: white;
+          padding: 20px;
+        }
+        .stats {
+          display: flex;
+          justify-content: space-around;
+          margin-bottom: 20px;
+          text-align: center;
+        }
+        .stat-block h1 {
+          font-size: 36px;
+          margin: 0;
+          color: #f5c518;
+        }
+        .legend {
+          display: flex;
+          justify-content: center;
+          gap: 30px;
+          margin-bottom: 20px;
+        }
+        .legend label {
+          display: flex;
+          align-items: center;
+          gap: 6px;
+          font-size: 16px;
+        }
+        input[type="checkbox"] {
+          transform: scale(1.2);
+        }
+        canvas {
+          background-color: #0d1b2a;
+        }
+      </style>
+    </head>
+    <body>
+      <div class="stats">
+        <div class="stat-block">
+          <h1>₹<span id="totalRevenue"></span> M</h1>
+          <div>Total Revenue</div>
+        </div>
+        <div class="stat-block">
+          <h1>₹<span id="totalProfit"></span> M</h1>
+          <div>Total Profit</div>
+        </div>
+        <div class="stat-block">
+          <h1><span id="totalKm"></span> K</h1>
+          <div>Total KM Cost</div>
+        </div>
+      </div>
+
+      <form method="get" class="legend">
+        <label>From <input type="date" name="from" value="{{ request.args.get('from', '') }}"></label>
+        <label>To <input type="date" name="to" value="{{ request.args.get('to', '') }}"></label>
+        <label>Bucket
+          <select name="bucket">
+            {% for b in ['auto', 'day', 'week', 'month', 'year'] %}
+              <option value="{{ b }}" {% if b == request.args.get('bucket', 'auto') %}selected{% endif %}>{{ b|capitalize }}</option>
+            {% endfor %}
+          </select>
+        </label>
+        <button type="submit">Apply</button>
+      </form>
+
+      <div class="legend">
+        <label><input type="checkbox" id="revenueCheckbox" checked> Total Revenue</label>
+        <label><input type="checkbox" id="expenseCheckbox" checked> Total Expense</label>
+        <label><input type="checkbox" id="profitCheckbox" checked> Trip Profit</label>
+      </div>
+
+      <canvas id="financeChart" height="100"></canvas>
+
+      <script>
+        const ctx = document.getElementById('financeChart').getContext('2d');
+
+        const chart = new Chart(ctx, {
+          type: 'bar',
+          data: {
+            labels: [],
+            datasets: [
+              {
+                label: 'Total Revenue',
+                backgroundColor: '#f5c518',
+                data: []
+              },
+              {
+                label: 'Total Expense',
+                backgroundColor: '#007bff',
+                data: []
+              },
+              {
+                label: 'Trip Profit',
+                backgroundColor: '#00c896',
+                data: []
+              }
+            ]
+          },
+          options: {
+            responsive: true,
+            plugins: {
+              legend: { display: false }
+            },
+            scales: {
+              x: {
+                ticks: { color: 'white' },
+                grid: { display: false }
+              },
+              y: {
+                ticks: { color: 'white' },
+                grid: { color: '#33415c' }
+              }
+            }
+          }
+        });
+
+        fetch('{{ url_for('api_financial') }}' + window.location.search)
+          .then(r => r.json())
+          .then(d => {
+            document.getElementById('totalRevenue').textContent = d.total_revenue;
+            document.getElementById('totalProfit').textContent = d.total_profit;
+            document.getElementById('totalKm').textContent = d.total_km;
+            chart.data.labels = d.days;
+            chart.data.datasets[0].data = d.revenue;
+            chart.data.datasets[1].data = d.expense;
+            chart.data.datasets[2].data = d.profit;
+            chart.update();
+          });
+
+        // Toggle logic
+        document.getElementById('revenueCheckbox').addEventListener('change', function () {
+          chart.data.datasets[0].hidden = !this.checked;
+          chart.update();
+        });
+        document.getElementById('expenseCheckbox').addEventListener('change', function () {
+          chart.data.datasets[1].hidden = !this.checked;
+          chart.update();
+        });
+        document.getElementById('profitCheckbox').addEventListener('change', function () {
+          chart.data.datasets[2].hidden = !this.checked;
+          chart.update();
+        });
+      </script>
+    </body>
+    </html>
+    '''
+}
+
+# TEMPLATES are served through a DictLoader so Jinja compiles each page once
+# and keeps it in its template cache; views only run the compiled template.
+# TEMPLATE_BYTECODE_DIR additionally persists the compiled bytecode so new
+# processes skip the compile step as well.
+def register_templates():
+    app.jinja_env.loader = ChoiceLoader([
+        DictLoader({f'{name}.html': source for name, source in TEMPLATES.items()}),
+        app.jinja_env.loader,
+    ])
+    bytecode_dir = os.environ.get('TEMPLATE_BYTECODE_DIR')
+    if bytecode_dir:
+        os.makedirs(bytecode_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
+    for name in TEMPLATES:
+        app.jinja_env.get_template(f'{name}.html')
+
+
+register_templates()
+
+def date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    parsed = pd.to_datetime(value, errors='coerce')
+    if pd.isna(parsed):
+        abort(400, f"Invalid '{name}' date: {value}")
+    return parsed
+
+
+def range_params():
+    # from/to dates (inclusive), or a whole month=YYYY-MM, plus the bucket size
+    start, end = date_arg('from'), date_arg('to')
+    month = request.args.get('month')
+    if month:
+        try:
+            period = pd.Period(month, freq='M')
+        except ValueError:
+            abort(400, f"Invalid 'month': {month}")
+        start, end = period.start_time, period.end_time.normalize()
+    bucket = request.args.get('bucket', 'auto')
+    if bucket != 'auto' and bucket not in BUCKETS:
+        abort(400, f"Invalid 'bucket': {bucket}")
+    if start is not None or end is not None:
+        # An open end runs to the first or last day of the data
+        first = start if start is not None or _dataset is None else _dataset.first_date
+        last = end if end is not None or _dataset is None else _dataset.last_date
+        if pd.notna(first) and pd.notna(last) and last > first + pd.DateOffset(years=RANGE_MAX_YEARS):
+            abort(400, f"Date range is longer than {RANGE_MAX_YEARS} years")
+    return start, end, bucket
+
+
+def report_params():
+    start, end, _ = range_params()
+    return request.args.get('vehicle') or '', request.args.get('route') or '', start, end
+
+
+def dashboard_metrics(dataset, vehicle, route, start=None, end=None, bucket='auto'):
+    def compute():
+        with timed('dashboard.slice'):
+            part = slice_dates(dataset.cube_slice(vehicle, route), start, end)
+            name, axis = dataset.axis(start, end, bucket)
+        if vehicle or route:
+            with timed('dashboard.summarize'):
+                m = summarize_cube(part, axis)
+        else:
+            # Unfiltered charts come straight off the rollup pyramid
+            with timed('dashboard.series'):
+                series = rollup_series(dataset.rollups, name, axis, start, end)
+            with timed('dashboard.summarize'):
+                m = dict(summarize_kpis(part), **chart_series(
+                    bucket_labels(axis), series['trips'].tolist(), series['audit'].tolist()))
+        m['bucket'] = name
+        with timed('dashboard.audit'):
+            flagged = dataset.audit()['masks']['trips'][dataset.rows_for(vehicle, route, start, end)]
+            m['rule_flags'] = int(np.count_nonzero(flagged))
+        with timed('dashboard.report'):
+            m['ai_report'] = format_ai_report(m)
+        return m
+    return cached_result('dashboard', dataset, compute, vehicle or '', route or '', start, end, bucket)
+
+
+def format_ai_report(m):
+    if not m['total_trips']:
+        return "No data available for AI report."
+    avg_profit_per_trip = round(m['profit'] / m['total_trips'], 2)
+    return f"""
+📊 AI Report Highlights:
+
+Total Trips: {m['total_trips']}
+On-going Trips: {m['ongoing']}
+Completed Trips: {m['closed']}
+Profit Percentage: {round((m['profit'] / m['rev'] * 100), 1) if m['rev'] else 0}%
+
+Financials:
+- Revenue: ₹{m['rev_m']}M
+- Expense: ₹{m['exp_m']}M
+- Profit: ₹{m['profit_m']}M
+- KMs Travelled: {m['kms_k']}K
+- Cost per KM: ₹{m['per_km']}
+
+AI Insights:
+- Top Vehicle: {m['top_vehicle']}
+- Average Profit per Trip: ₹{avg_profit_per_trip}
+- Top Routes: {m['top_routes']}
+"""
+
+@app.route('/')
+def home():
+    return redirect(url_for('signup'))
+
+@app.route('/signup', methods=['GET', 'POST'])
+def signup():
+    if request.method == 'POST':
+        # The unique email index rejects existing users
+        with PASSWORD_SECONDS.labels('hash').time():
+            password_hash = generate_password_hash(request.form['password'])
+        if not create_user(request.form['fullname'], request.form['email'], password_hash):
+            return render_template('signup.html', error="Email already registered!")
+
+        return redirect(url_for('login'))
+
+    return render_template('signup.html')
+
+
+@app.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        user = get_user(request.form['email'])
+        with PASSWORD_SECONDS.labels('verify').time():
+            valid = bool(user) and check_password_hash(user['password'], request.form['password'])
+        if valid:
+            # Only what the views need; never the password hash
+            session['user'] = {'name': user['name'], 'email': user['email'], 'role': user['role']}
+            return redirect(url_for('dashboard'))
+        return 'Invalid credentials. <a href="' + url_for('login') + '">Try again</a>'
+    return render_template('login.html')
+
+@app.route('/dashboard')
+def dashboard():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    vehicle = request.args.get('vehicle')
+    route = request.args.get('route')
+    start, end, bucket = range_params()
+    dataset = current_dataset()
+    m = dashboard_metrics(dataset, vehicle, route, start, end, bucket)
+
+    with timed('dashboard.render'):
+        return render_template('dashboard.html',
+            total_trips=m['total_trips'], ongoing=m['ongoing'], closed=m['closed'],
+            flags=m['flags'], resolved=m['resolved'], rule_flags=m['rule_flags'], rev_m=m['rev_m'], exp_m=m['exp_m'],
+            profit_m=m['profit_m'], kms_k=m['kms_k'], per_km=m['per_km'], profit_pct=m['profit_pct'],
+            ai_report=m['ai_report'], vehicles=dataset.vehicles, routes=dataset.routes,
+            selected_vehicle=vehicle, selected_route=route, months=list(dataset.months),
+            selected_month=request.args.get('month', ''), date_from=request.args.get('from', ''),
+            date_to=request.args.get('to', ''), bucket=bucket, chart_bucket=m['bucket'],
+            version=dataset.version, retry_ms=EVENT_RETRY_MS)
+
+# Table pages are paginated server side (offset/size, sort, q search) and
+# streamed, so a request only ever materializes one page of rows.
+TABLE_PAGE_SIZE = 50
+TABLE_MAX_PAGE_SIZE = 500
+TABLE_CHUNK_ROWS = 100
+
+
+def int_arg(name, default, lo, hi):
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        value = default
+    return max(lo, min(hi, value))
+
+
+def table_url(**changes):
+    args = request.args.to_dict()
+    args.update(changes)
+    return url_for(request.endpoint, **{k: v for k, v in args.items() if v not in (None, '')})
+
+
+def stream_table(title, frame, columns, live=None, positions=None, computed=None):
+    # Lists frame's rows at positions (all of them by default). Search and
+    # sort read only the columns they need at those positions; just the
+    # page's rows are taken. computed: column -> function of positions giving
+    # that column's values, for columns frame does not hold. live: the Trip
+    # Status the page lists, to follow it over /api/stream
+    size = int_arg('size', TABLE_PAGE_SIZE, 1, TABLE_MAX_PAGE_SIZE)
+    offset = int_arg('offset', 0, 0, 2 ** 62)
+    sort = request.args.get('sort', '')
+    q = request.args.get('q', '').strip()
+
+    computed = computed or {}
+
+    def column(col, positions):
+        if col in computed:
+            return pd.Series(computed[col](positions))
+        return pd.Series(frame[col].array.take(positions))
+
+    if positions is None:
+        positions = np.arange(len(frame))
+    if q:
+        hit = np.zeros(len(positions), dtype=bool)
+        for col in columns:
+            values = column(col, positions)
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                # Match each category once, then look rows up by code
+                matched = values.cat.categories.astype(str).str.contains(q, case=False, regex=False)
+                hit |= np.append(matched, False)[values.cat.codes.to_numpy()]
+            else:
+                hit |= values.astype(str).str.contains(q, case=False, regex=False, na=False).to_numpy()
+        positions = positions[hit]
+    if sort.lstrip('-') in columns:
+        key = column(sort.lstrip('-'), positions)
+        order = key.sort_values(ascending=not sort.startswith('-'), kind='stable').index.to_numpy()
+        positions = positions[order]
+
+    total = len(positions)
+    at = positions[offset:offset + size]
+    page = frame.iloc[at, frame.columns.get_indexer([c for c in columns if c not in computed])]
+    if computed:
+        page = page.assign(**{col: get(at) for col, get in computed.items()})[columns]
+    next_offset = offset + size if offset + size < total else None
+    prev_offset = max(offset - size, 0) if offset else None
+
+    def rows():
+        for start in range(0, len(page), TABLE_CHUNK_ROWS):
+            chunk = page.iloc[start:start + TABLE_CHUNK_ROWS]
+            yield from chunk.astype(object).where(chunk.notna(), '').itertuples(index=False, name=None)
+
+    if request.args.get('format') == 'json':
+        def generate():
+            yield json.dumps({'title': title, 'columns': columns, 'total': total, 'offset': offset,
+                              'size': size, 'next_offset': next_offset})[:-1] + ', "rows": ['
+            for start in range(0, len(page), TABLE_CHUNK_ROWS):
+                chunk = page.iloc[start:start + TABLE_CHUNK_ROWS]
+                records = json.dumps(chunk.astype(object).where(chunk.notna(), None).to_dict('records'), default=str)
+                yield ('' if start == 0 else ', ') + records[1:-1]
+            yield ']}'
+        return Response(stream_with_context(generate()), mimetype='application/json')
+
+    sort_urls = {col: table_url(sort=('-' + col) if sort == col else col, offset=None) for col in columns}
+    return Response(stream_template('table_page.html',
+        title=title, columns=columns, rows=rows(), total=total, q=q, sort=sort, size=size,
+        first=offset + 1 if total else 0, last=min(offset + size, total),
+        prev_url=table_url(offset=prev_offset) if prev_offset is not None else None,
+        next_url=table_url(offset=next_offset) if next_offset is not None else None,
+        json_url=table_url(format='json'), sort_urls=sort_urls,
+        live=live, version=current_dataset().version, retry_ms=EVENT_RETRY_MS))
+
+
+@app.route('/trip-generator')
+def trip_generator():
+    df = current_dataset().df
+    return stream_table("Trip Generator", df, ['Trip ID', 'Vehicle ID', 'Trip Status'])
+
+@app.route('/trip-closure')
+def trip_closure():
+    dataset = current_dataset()
+    return stream_table("Trip Closure", dataset.df, ['Trip ID', 'Vehicle ID', 'Trip Status'],
+                        positions=dataset.rows_with_status('Pending Closure'))
+
+@app.route('/trip-auditor')
+def trip_auditor():
+    # Tagged and rule-flagged trips; ?rule=<name> lists one rule's flags
+    dataset = current_dataset()
+    rule = request.args.get('rule')
+    if rule and rule not in [r['name'] for r in AUDIT_RULES]:
+        abort(400, f"Unknown audit rule: {rule}")
+    # The flags are labelled only for the rows a search, sort or page reads
+    masks = dataset.audit()['masks']['trips']
+    columns = ['Trip ID', 'Vehicle ID', 'Trip Status', 'POD Status', 'Audit Flags']
+    return stream_table("Trip Auditor", dataset.df, columns, positions=dataset.audit_queue(rule),
+                        computed={'Audit Flags': lambda at: audit_labels(masks[at])})
+
+@app.route('/trip-ongoing')
+def trip_ongoing():
+    dataset = current_dataset()
+    return stream_table("Ongoing Trips", dataset.df, ['Trip ID', 'Vehicle ID', 'Trip Status'],
+                        live='Pending Closure', positions=dataset.rows_with_status('Pending Closure'))
+
+@app.route('/trip/<trip_id>')
+def trip_detail(trip_id):
+    # Fleet and closure rows side by side; amounts that disagree are marked
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    fleet, closure = current_dataset().trip(trip_id)
+    if not len(fleet) and not len(closure):
+        abort(404, f"Unknown trip: {trip_id}")
+    first_row = np.zeros(1, dtype=np.intp)
+    differs = [c for c in RECONCILE_COLUMNS if len(fleet) and len(closure) and c in fleet.columns
+               and c in closure.columns
+               and amounts_differ(take_values(fleet, c, first_row), take_values(closure, c, first_row))[0]]
+    notes = [f"Not in the {side} sheet." for side, frame in (('fleet', fleet), ('closure', closure)) if not len(frame)]
+    notes += [f"{len(frame)} {side} rows share this Trip ID; the first is shown."
+              for side, frame in (('fleet', fleet), ('closure', closure)) if len(frame) > 1]
+    if request.args.get('format') == 'json':
+        records = {side: frame.astype(object).where(frame.notna(), None).to_dict('records')
+                   for side, frame in (('fleet', fleet), ('closure', closure))}
+        return Response(json.dumps(dict(trip_id=trip_id, differs=differs, **records), default=str),
+                        mimetype='application/json')
+    first = [frame.iloc[0].astype(object).where(frame.iloc[0].notna(), '') if len(frame) else {}
+             for frame in (fleet, closure)]
+    columns = list(fleet.columns) + [c for c in closure.columns if c not in fleet.columns]
+    fields = [(c, first[0].get(c, ''), first[1].get(c, ''), c in differs) for c in columns]
+    return render_template('trip.html', trip_id=trip_id, notes=notes, fields=fields)
+
+
+@app.route('/reconciliation')
+def reconciliation():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    rows = current_dataset().reconciliation()['rows']
+    return stream_table("Fleet / Closure Reconciliation", rows, list(rows.columns))
+
+
+def trip_stats_series(dataset, start, end, bucket):
+    # Status counts per bucket come from the rollup pyramid
+    name, axis = dataset.axis(start, end, bucket)
+    series = rollup_series(dataset.rollups, name, axis, start, end)
+    total = series['trips'].tolist()
+    ongoing = series['pending'].tolist()
+    closed = series['completed'].tolist()
+
+    # Sum totals to display numeric counts
+    return {'labels': bucket_labels(axis), 'bucket': name, 'total': total, 'ongoing': ongoing, 'closed': closed,
+            'total_sum': sum(total), 'ongoing_sum': sum(ongoing), 'closed_sum': sum(closed)}
+
+
+@app.route('/trip-stats')
+def trip_stats():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    return render_template('trip_stats.html')
+
+
+FINANCE_RECENT_DAYS = 10
+
+
+def financial_series(dataset, start, end, bucket):
+    # Use closure_df for financial stats; default to the last 10 days of data
+    df_fin = dataset.closure_df
+    ranged = start is not None or end is not None
+    first, last = df_fin['Trip Date'].min(), df_fin['Trip Date'].max()
+    if not ranged and pd.notna(last):
+        first = last - pd.Timedelta(days=FINANCE_RECENT_DAYS - 1)
+    name, axis = bucket_axis(start if start is not None else first, end if end is not None else last, bucket)
+
+    series = rollup_series(dataset.closure_rollups, name, axis, start if ranged else first, end)
+    revenue_data = series['rev'].astype(int).tolist()
+    expense_data = series['exp'].astype(int).tolist()
+    profit_data = [r - e for r, e in zip(revenue_data, expense_data)]
+
+    totals = rollup_totals(dataset.closure_rollups, start, end)
+    return {'days': bucket_labels(axis), 'bucket': name,
+            'revenue': revenue_data, 'expense': expense_data, 'profit': profit_data,
+            'total_revenue': float(round(totals['rev'] / 1e6, 2)),
+            'total_profit': float(round(totals['profit'] / 1e6, 2)),
+            'total_km': float(round(totals['kms'] / 1e3, 1))}
 
 
 @app.route('/financial-dashboard')
 def financial_dashboard():
-    # Use closure_df for financial stats
-    df_fin = closure_df.copy()
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    return render_template('financial_dashboard.html')
 
-    recent_days = sorted(df_fin['Day'].dropna().unique())[-10:]
-    day_labels = [f"Day {int(d)}" for d in recent_days]
 
-    daily = df_fin[df_fin['Day'].isin(recent_days)]
+# JSON chart data. The ETag depends only on the data version and the query
+# string, so a poll for unchanged data is answered with 304 before any pandas
+# work happens.
+API_CACHE_CONTROL = 'private, no-cache'
 
-    revenue_data = daily.groupby('Day')['Freight Amount'].sum().reindex(recent_days, fill_value=0).astype(int).tolist()
-    expense_data = daily.groupby('Day')['Total Trip Expense'].sum().reindex(recent_days, fill_value=0).astype(int).tolist()
-    profit_data = [r - e for r, e in zip(revenue_data, expense_data)]
 
-    total_revenue = round(df_fin['Freight Amount'].sum() / 1e6, 2)
-    total_profit = round(df_fin['Net Profit'].sum() / 1e6, 2)
-    total_km = round(df_fin['Actual Distance (KM)'].sum() / 1e3, 1)
-
-    return render_template_string("""
-<!DOCTYPE html>
-<html lang="en">
-<head>
-  <meta charset="UTF-8">
-  <title>Financial Dashboard</title>
-  <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-  <style>
-    body {
-      background-color: #0d1b2a;
-      font-family: Arial, sans-serif;
-      color: white;
-      padding: 20px;
-    }
-    .stats {
-      display: flex;
-      justify-content: space-around;
-      margin-bottom: 20px;
-      text-align: center;
-    }
-    .stat-block h1 {
-      font-size: 36px;
-      margin: 0;
-      color: #f5c518;
-    }
-    .legend {
-      display: flex;
-      justify-content: center;
-      gap: 30px;
-      margin-bottom: 20px;
-    }
-    .legend label {
-      display: flex;
-      align-items: center;
-      gap: 6px;
-      font-size: 16px;
-    }
-    input[type="checkbox"] {
-      transform: scale(1.2);
-    }
-    canvas {
-      background-color: #0d1b2a;
-    }
-  </style>
-</head>
-<body>
-  <div class="stats">
-    <div class="stat-block">
-      <h1>₹{{ total_revenue }} M</h1>
-      <div>Total Revenue</div>
-    </div>
-    <div class="stat-block">
-      <h1>₹{{ total_profit }} M</h1>
-      <div>Total Profit</div>
-    </div>
-    <div class="stat-block">
-      <h1>{{ total_km }} K</h1>
-      <div>Total KM Cost</div>
-    </div>
-  </div>
-
-  <div class="legend">
-    <label><input type="checkbox" id="revenueCheckbox" checked> Total Revenue</label>
-    <label><input type="checkbox" id="expenseCheckbox" checked> Total Expense</label>
-    <label><input type="checkbox" id="profitCheckbox" checked> Trip Profit</label>
-  </div>
-
-  <canvas id="financeChart" height="100"></canvas>
-
-  <script>
-    const ctx = document.getElementById('financeChart').getContext('2d');
-    const days = {{ days | safe }};
-    const revenueData = {{ revenue | safe }};
-    const expenseData = {{ expense | safe }};
-    const profitData = {{ profit | safe }};
-
-    const chart = new Chart(ctx, {
-      type: 'bar',
-      data: {
-        labels: days,
-        datasets: [
-          {
-            label: 'Total Revenue',
-            backgroundColor: '#f5c518',
-            data: revenueData
-          },
-          {
-            label: 'Total Expense',
-            backgroundColor: '#007bff',
-            data: expenseData
-          },
-          {
-            label: 'Trip Profit',
-            backgroundColor: '#00c896',
-            data: profitData
-          }
-        ]
-      },
-      options: {
-        responsive: true,
-        plugins: {
-          legend: { display: false }
-        },
-        scales: {
-          x: {
-            ticks: { color: 'white' },
-            grid: { display: false }
-          },
-          y: {
-            ticks: { color: 'white' },
-            grid: { color: '#33415c' }
-          }
-        }
-      }
-    });
-
-    // Toggle logic
-    document.getElementById('revenueCheckbox').addEventListener('change', function () {
-      chart.data.datasets[0].hidden = !this.checked;
-      chart.update();
-    });
-    document.getElementById('expenseCheckbox').addEventListener('change', function () {
-      chart.data.datasets[1].hidden = !this.checked;
-      chart.update();
-    });
-    document.getElementById('profitCheckbox').addEventListener('change', function () {
-      chart.data.datasets[2].hidden = !this.checked;
-      chart.update();
-    });
-  </script>
-</body>
-</html>
-    """, days=day_labels, revenue=revenue_data, expense=expense_data, profit=profit_data,
-         total_revenue=total_revenue, total_profit=total_profit, total_km=total_km)
+def json_series(name, compute):
+    if 'user' not in session:
+        return jsonify(error='login required'), 401
+    dataset = current_dataset()
+    params = sorted(request.args.items(multi=True))
+    etag = hashlib.sha1(json.dumps([name, dataset.version, dataset.owner, params]).encode()).hexdigest()
+    # Weak: the same data may be sent gzip- or brotli-encoded
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(compute(dataset))
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = API_CACHE_CONTROL
+    response.vary.add('Cookie')
+    return response
+
+
+def dashboard_series(dataset):
+    m = dashboard_metrics(dataset, request.args.get('vehicle'), request.args.get('route'), *range_params())
+    return {'version': dataset.version, 'bucket': m['bucket'], 'labels': m['labels'],
+            'daily': m['daily'], 'audited': m['audited'], 'audit_pct': m['audit_pct'],
+            'bar_labels': m['bar_labels'], 'bar_values': m['bar_values'],
+            'kpis': {k: m[k] for k in ('total_trips', 'ongoing', 'closed', 'flags', 'resolved')}}
+
+
+@app.route('/api/dashboard')
+def api_dashboard():
+    return json_series('dashboard', dashboard_series)
+
+
+@app.route('/api/trip-stats')
+def api_trip_stats():
+    params = range_params()
+    return json_series('trip-stats', lambda dataset: dict(
+        cached_result('trip-stats', dataset, lambda: trip_stats_series(dataset, *params), *params),
+        version=dataset.version))
+
+
+@app.route('/api/financial')
+def api_financial():
+    params = range_params()
+    return json_series('financial', lambda dataset: dict(
+        cached_result('financial', dataset, lambda: financial_series(dataset, *params), *params),
+        version=dataset.version))
+
+
+@app.route('/api/report')
+def api_report():
+    vehicle, route, start, end = report_params()
+
+    def compute(dataset):
+        def build():
+            m = summarize_cube(slice_dates(dataset.cube_slice(vehicle, route), start, end))
+            return dict(report_json(m), report=format_ai_report(m))
+        return dict(cached_result('report', dataset, build, vehicle, route, start, end),
+                    version=dataset.version)
+    return json_series('report', compute)
+
+
+@app.route('/api/report/months')
+def api_report_months():
+    vehicle, route, start, end = report_params()
+
+    def compute(dataset):
+        months = cached_result('report-months', dataset, lambda: compare_months(
+            slice_dates(dataset.cube_slice(vehicle, route), start, end)), vehicle, route, start, end)
+        return {'version': dataset.version, 'months': months}
+    return json_series('report-months', compute)
+
+@app.route('/api/reconciliation')
+def api_reconciliation():
+    def compute(dataset):
+        return dict(dataset.reconciliation()['summary'], version=dataset.version)
+    return json_series('reconciliation', compute)
+
+
+@app.route('/api/audit')
+def api_audit():
+    def compute(dataset):
+        audit = dataset.audit()
+        return {'version': dataset.version, 'scan_seconds': audit['seconds'],
+                'queue': int(len(dataset.audit_queue())),
+                'rules': [{'name': r['name'], 'title': r['title'], 'kind': r['kind'],
+                           'flagged': audit['counts'][r['name']]} for r in AUDIT_RULES]}
+    return json_series('audit', compute)
+
+
+# Server-Sent Events for the open dashboard and ongoing-trips pages. Takes
+# the dashboard filters; since= (or Last-Event-ID on reconnect) is the data
+# version the page was rendered from. Sends 'update' events with the changed
+# KPIs, chart points and status transitions, 'reset' when the page must reload,
+# and a keep-alive comment every EVENT_KEEPALIVE seconds.
+@app.route('/api/stream')
+def live_stream():
+    if 'user' not in session:
+        return jsonify(error='login required'), 401
+    start, end, bucket = range_params()
+    dataset = current_dataset()
+    scope = None if dataset.owner is None else frozenset(
+        v for v, owner in dataset.owners.items() if owner == dataset.owner)
+    key = (scope, request.args.get('vehicle') or '', request.args.get('route') or '', start, end, bucket)
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    subscriber = live_feed.subscribe(key, since)
+    feed = live_feed
+
+    def generate():
+        try:
+            yield f"retry: {EVENT_RETRY_MS}\n\n"
+            while True:
+                message = subscriber.get()
+                if message is None:
+                    return
+                yield message
+        finally:
+            feed.unsubscribe(subscriber)
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-store', 'X-Accel-Buffering': 'no'})
+
+# Bulk ingestion: POST a JSON list of row objects (or {"rows": [...]}) or a
+# text/csv body to /api/ingest/trips or /api/ingest/closures. Rows use the
+# workbook column names. A cross-site form can send neither content type
+# without a CORS preflight, so a session cookie alone cannot post rows.
+# Owner accounts ingest only for their own fleet, so only with an owner
+# mapping.
+def ingest_rows():
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        rows = payload.get('rows') if isinstance(payload, dict) else payload
+        if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+            raise ValueError("Expected a JSON list of row objects")
+        return pd.DataFrame.from_records(rows)
+    return pd.read_csv(io.BytesIO(request.get_data()), dtype=str)
+
+
+def check_owner(dataset, batch):
+    # Owners add trips and closures for their own vehicles (closures without
+    # a Vehicle ID column for their own trips)
+    if dataset.owner is None:
+        return
+    if 'Vehicle ID' in batch.columns:
+        column, foreign = 'Vehicle ID', batch['Vehicle ID'].map(dataset.owners) != dataset.owner
+    else:
+        column, foreign = 'Trip ID', ~batch['Trip ID'].isin(dataset.trip_ids)
+    bad = np.flatnonzero(foreign.to_numpy())
+    if len(bad):
+        raise ValueError(f"{column} {batch[column][bad[0]]!r} in row {bad[0] + 1} is not in your fleet")
+
+
+@app.route('/api/ingest/<kind>', methods=['POST'])
+def ingest(kind):
+    if 'user' not in session:
+        return jsonify(error='login required'), 401
+    if kind not in ('trips', 'closures'):
+        abort(404)
+    if not request.is_json and request.mimetype != 'text/csv':
+        return jsonify(error="Send rows as application/json or text/csv"), 415
+    dataset = current_dataset()
+    if session['user'].get('role', 'Owner') == 'Owner' and dataset.owners is None:
+        return jsonify(error="Owner accounts cannot ingest without a vehicle owner mapping"), 403
+    try:
+        rows = ingest_rows()
+        if not len(rows):
+            raise ValueError("No rows to ingest")
+        if len(rows) > INGEST_MAX_ROWS:
+            return jsonify(error=f"At most {INGEST_MAX_ROWS} rows per batch"), 413
+        batch = validate_batch(rows, dataset.df if kind == 'trips' else dataset.closure_df, dataset.df.columns)
+        check_owner(dataset, batch)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if not append_journal(kind, batch, dataset.source):
+        return jsonify(error="The workbooks changed while this batch was checked, send it again"), 409
+    reload_dataset()
+    g.pop('dataset')
+    dataset = current_dataset()
+    return jsonify(kind=kind, accepted=len(batch), version=dataset.version,
+                   trips=len(dataset.df), closures=len(dataset.closure_df)), 201
+
+
+def frame_memory(frame):
+    usage = frame.memory_usage(index=True, deep=True)
+    return {'rows': len(frame), 'bytes': int(usage.sum()),
+            'columns': {str(c): {'dtype': str(frame[c].dtype) if c in frame.columns else str(frame.index.dtype),
+                                 'bytes': int(b)} for c, b in usage.items()}}
+
+
+@app.route('/admin/memory')
+def memory_stats():
+    if 'user' not in session:
+        return jsonify(error='login required'), 401
+    dataset = current_dataset()
+    frames = {'df': dataset.df, 'closure_df': dataset.closure_df, 'cube': dataset.cube}
+    report = {name: frame_memory(frame) for name, frame in frames.items()}
+    return jsonify(version=dataset.version, total_bytes=sum(r['bytes'] for r in report.values()), frames=report)
+
+
+# Routes that work without trip data; everything else waits for the first load
+WARM_UP_ENDPOINTS = {'static', 'home', 'signup', 'login', 'logout', 'healthz', 'readyz', 'metrics', 'cache_stats'}
+WARM_UP_RETRY_AFTER = 5
+
+
+@app.before_request
+def warm_up_gate():
+    if _dataset is not None or request.endpoint in WARM_UP_ENDPOINTS:
+        return None
+    headers = {'Retry-After': str(WARM_UP_RETRY_AFTER), 'Cache-Control': 'no-store'}
+    if request.path.startswith('/api/') or request.accept_mimetypes.best == 'application/json':
+        return jsonify(status='warming up', error=_load_error), 503, headers
+    return (f'<meta http-equiv="refresh" content="{WARM_UP_RETRY_AFTER}">'
+            'Trip data is still loading. This page will refresh in a few seconds.'), 503, headers
+
+
+@app.route('/healthz')
+def healthz():
+    # Liveness: the process is serving requests, data or not
+    return jsonify(status='ok')
+
+
+@app.route('/readyz')
+def readyz():
+    dataset = _dataset
+    if dataset is None:
+        return jsonify(status='failed' if _load_error else 'loading', error=_load_error), 503, \
+            {'Retry-After': str(WARM_UP_RETRY_AFTER), 'Cache-Control': 'no-store'}
+    return jsonify(status='ready', version=dataset.version, source=dataset.source,
+                   trips=len(dataset.df), closures=len(dataset.closure_df), cube_rows=len(dataset.cube),
+                   loaded_at=_loaded_at), 200, {'Cache-Control': 'no-store'}
+
+
+@app.route('/metrics')
+def metrics():
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+
+@app.route('/admin/cache')
+def cache_stats():
+    if 'user' not in session:
+        return jsonify(error='login required'), 401
+    return jsonify(result_cache.stats())
 
 
 @app.route('/logout')
@@ -628,10 +3422,532 @@ def logout():
 
 @app.route('/download-summary')
 def download_summary():
-    filtered = df
-    report = generate_ai_report(filtered)
-    with open("AI_Report_Summary.txt", 'w', encoding='utf-8') as f:
-        f.write(report)
-    return send_file("AI_Report_Summary.txt", as_attachment=True)
+    report = dashboard_metrics(current_dataset(), request.args.get('vehicle'), request.args.get('route'),
+                               *range_params())['ai_report']
+    return send_file(io.BytesIO(report.encode('utf-8')), as_attachment=True,
+                     download_name="AI_Report_Summary.txt", mimetype='text/plain')
+
+
+# Trip exports are streamed in row chunks so a large export never sits in
+# worker memory as a whole.
+EXPORT_CHUNK_ROWS = 10000
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def export_rows(dataset, vehicle, route, start=None, end=None, progress=None):
+    columns = list(dataset.df.columns)
+    positions = dataset.rows_for(vehicle, route, start, end)
+    for lo in range(0, len(positions), EXPORT_CHUNK_ROWS):
+        yield dataset.df[columns].take(positions[lo:lo + EXPORT_CHUNK_ROWS])
+        if progress:
+            progress(min(lo + EXPORT_CHUNK_ROWS, len(positions)) / len(positions))
+
+
+def write_xlsx(columns, chunks, f):
+    # Write-only workbooks spool rows to disk, so memory stays bounded by one
+    # chunk
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Trips')
+    ws.append(columns)
+    for chunk in chunks:
+        for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+            ws.append(row)
+    wb.save(f)
+
+
+def export_name(extension, stem='trips'):
+    parts = [stem] + [request.args[k] for k in ('vehicle', 'route') if request.args.get(k)]
+    return secure_filename('_'.join(parts)) + extension
+
+
+@app.route('/export/trips.csv')
+def export_trips_csv():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    dataset = current_dataset()
+    start, end, _ = range_params()
+    chunks = export_rows(dataset, request.args.get('vehicle'), request.args.get('route'), start, end)
+
+    def generate():
+        header = True
+        for chunk in chunks:
+            yield chunk.to_csv(index=False, header=header)
+            header = False
+        if header:
+            yield ','.join(dataset.df.columns) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={export_name(".csv")}'})
+
+
+@app.route('/export/trips.xlsx')
+def export_trips_xlsx():
+    if 'user' not in session:
+        return redirect(url_for('login'))
+    dataset = current_dataset()
+    start, end, _ = range_params()
+    chunks = export_rows(dataset, request.args.get('vehicle'), request.args.get('route'), start, end)
+
+    def generate():
+        # The finished file is read back in blocks
+        with tempfile.TemporaryFile() as f:
+            write_xlsx(list(dataset.df.columns), chunks, f)
+            f.seek(0)
+            while True:
+                block = f.read(64 * 1024)
+                if not block:
+                    break
+                yield block
+
+    return Response(stream_with_context(generate()), mimetype=XLSX_MIMETYPE,
+                    headers={'Content-Disposition': f'attachment; filename={export_name(".xlsx")}'})
+
+
+# Background jobs: long reports and exports run in their own processes
+# instead of the request thread, where pandas holding the GIL stalls the
+# worker's other requests. POST /api/jobs?kind=... (with the filters of the
+# page or export the job stands in for) answers with the job's status; poll
+# /api/jobs/<id> and fetch /api/jobs/<id>/download once it is done. Job
+# records live in the user database: any worker queues jobs and answers
+# polls, and one runner in the process that owns data reloads (the gunicorn
+# master, or the only process) starts them. Each job is forked from that
+# process and reads its snapshot copy-on-write, so only the filters cross
+# over, and stopping the server stops its jobs. A job's id is its kind,
+# filters, data version and owner, so submitting the same job again joins it.
+JOB_DIR = os.environ.get('JOB_DIR', os.path.join('/tmp', 'fleet_jobs'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', '20'))
+# Finished jobs and their files are kept for JOB_RETENTION seconds, and at
+# most JOB_MAX_ARTIFACTS files at once
+JOB_RETENTION = float(os.environ.get('JOB_RETENTION', '3600'))
+JOB_MAX_ARTIFACTS = int(os.environ.get('JOB_MAX_ARTIFACTS', '100'))
+JOB_PROGRESS_INTERVAL = 1
+JOB_PURGE_INTERVAL = 60
+JOB_POLL_INTERVAL = 1
+_job_runner = None
+_last_job_purge = 0
+
+
+def summary_job(dataset, p, f, progress):
+    # The report /download-summary serves, over any range
+    f.write(dashboard_metrics(dataset, p['vehicle'], p['route'], p['start'], p['end'])['ai_report'].encode('utf-8'))
+
+
+def trips_csv_job(dataset, p, f, progress):
+    text = io.TextIOWrapper(f, encoding='utf-8', newline='')
+    header = True
+    for chunk in export_rows(dataset, p['vehicle'], p['route'], p['start'], p['end'], progress):
+        chunk.to_csv(text, index=False, header=header)
+        header = False
+    if header:
+        text.write(','.join(dataset.df.columns) + '\n')
+    text.detach()
+
+
+def trips_xlsx_job(dataset, p, f, progress):
+    write_xlsx(list(dataset.df.columns), export_rows(dataset, p['vehicle'], p['route'], p['start'], p['end'],
+                                                     progress), f)
+
+
+def trip_values(dataset, column, trip_ids):
+    # column of the first fleet row with each Trip ID (missing without one)
+    if column not in dataset.df.columns:
+        return np.full(len(trip_ids), None, dtype=object)
+    ids, first = first_rows(dataset.trip_ids)
+    hit = ids.get_indexer(trip_ids)
+    values = dataset.df[column].to_numpy(dtype=object, na_value=None).take(first)
+    return np.where(hit >= 0, values.take(np.maximum(hit, 0)), None)
+
+
+def financial_job(dataset, p, f, progress):
+    # Dated closure financials per month and vehicle. A closure has its own
+    # vehicle (its trip's when blank) but no route: the route filter goes
+    # through its trip, so closures matching no trip never pass it.
+    frame = dataset.closures_between(p['start'], p['end'])
+    frame = frame[frame.index.notna()]
+    if 'Vehicle ID' in frame.columns:
+        vehicles = frame['Vehicle ID'].to_numpy(dtype=object, na_value=None)
+        blank = pd.isna(vehicles)
+        if blank.any():
+            vehicles[blank] = trip_values(dataset, 'Vehicle ID', frame['Trip ID'][blank])
+    else:
+        vehicles = trip_values(dataset, 'Vehicle ID', frame['Trip ID'])
+    mine = np.ones(len(frame), dtype=bool)
+    if p['vehicle']:
+        mine &= vehicles == p['vehicle']
+    if p['route']:
+        mine &= trip_values(dataset, 'Route', frame['Trip ID']) == p['route']
+    frame, vehicles = frame[mine], vehicles[mine]
+    progress(0.4)
+    values = pd.DataFrame({'Closures': np.ones(len(frame), dtype='int64')})
+    for column in ROLLUP_COLUMNS.values():
+        values[column] = frame[column].to_numpy(dtype='float64', na_value=0)
+    keys = [frame.index.to_period('M').rename('Month'), pd.Index(vehicles, name='Vehicle ID')]
+    table = values.groupby(keys, observed=True, dropna=False).sum().reset_index()
+    progress(0.8)
+    table['Month'] = table['Month'].astype(str)
+    revenue, profit, kms = (table[ROLLUP_COLUMNS[k]] for k in ('rev', 'profit', 'kms'))
+    table['Profit %'] = (profit / revenue.where(revenue != 0) * 100).round(1).fillna(0)
+    table['Profit per KM'] = (profit / kms.where(kms != 0)).round(2).fillna(0)
+    text = io.TextIOWrapper(f, encoding='utf-8', newline='')
+    table.to_csv(text, index=False)
+    text.detach()
+
+
+# kind: (job, download mimetype); the kind's extension is the file's
+JOB_KINDS = {
+    'summary.txt': (summary_job, 'text/plain'),
+    'trips.csv': (trips_csv_job, 'text/csv'),
+    'trips.xlsx': (trips_xlsx_job, XLSX_MIMETYPE),
+    'financial.csv': (financial_job, 'text/csv'),
+}
+
+
+def job_filename(kind):
+    if kind == 'summary.txt':
+        return 'AI_Report_Summary.txt'
+    stem, extension = os.path.splitext(kind)
+    return export_name(extension, stem)
+
+
+def init_job_process():
+    # Job processes inherit the signal handlers of the process that forked
+    # them (gunicorn's arbiter, say); the runner alone decides when they stop
+    signal.set_wakeup_fd(-1)
+    for sig in (signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT, signal.SIGUSR1, signal.SIGUSR2,
+                signal.SIGTTIN, signal.SIGTTOU, signal.SIGWINCH, signal.SIGCHLD):
+        signal.signal(sig, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def job_progress(job_id):
+    last = [0]
+
+    def report(fraction):
+        now = time.monotonic()
+        if now - last[0] >= JOB_PROGRESS_INTERVAL:
+            last[0] = now
+            with user_db() as conn:
+                conn.execute('UPDATE jobs SET progress = ? WHERE id = ?', (min(fraction, 1), job_id))
+    return report
+
+
+def finish_job(job_id, status, path=None, size=None, error=None):
+    with user_db() as conn:
+        conn.execute('''UPDATE jobs SET status = ?, progress = ?, path = ?, size = ?, error = ?, finished = ?
+                        WHERE id = ? AND status IN ('queued', 'running')''',
+                     (status, 1 if status == 'done' else 0, path, size, error, time.time(), job_id))
+
+
+def run_job(job_id, kind, dataset, params):
+    # Runs in the job's process; the runner learns the outcome from the row
+    path = os.path.join(JOB_DIR, job_id + os.path.splitext(kind)[1])
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        p = dict(params, start=params['start'] and pd.Timestamp(params['start']),
+                 end=params['end'] and pd.Timestamp(params['end']))
+        os.makedirs(JOB_DIR, exist_ok=True)
+        with open(tmp, 'wb') as f:
+            JOB_KINDS[kind][0](dataset, p, f, job_progress(job_id))
+        os.replace(tmp, path)
+    except Exception as e:
+        app.logger.exception("Job %s (%s) failed", job_id, kind)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        finish_job(job_id, 'failed', error=str(e) or type(e).__name__)
+        return
+    finish_job(job_id, 'done', path=path, size=os.path.getsize(path))
+
+
+class JobRunner:
+    # Starts queued jobs, at most JOB_WORKERS at once, each in a process
+    # forked with this process's snapshot. A job submitted on ingested
+    # batches this process has not applied yet waits until it has; one
+    # submitted before the workbooks changed runs on the new snapshot.
+    def __init__(self):
+        self.pid = os.getpid()
+        self.running = {}  # process id: (job row, start time)
+        self.stopped = False
+        self.lock = threading.Lock()
+
+    def run(self):
+        while not self.stopped:
+            try:
+                self.reap()
+                self.start_jobs()
+                purge_jobs()
+            except Exception:
+                app.logger.exception("Running background jobs failed")
+            time.sleep(JOB_POLL_INTERVAL)
+
+    def reap(self):
+        for pid in list(self.running):
+            try:
+                exited = os.waitpid(pid, os.WNOHANG)[0] == pid
+            except ChildProcessError:
+                # Reaped already: gunicorn's arbiter waits for any child
+                exited = True
+            if not exited:
+                continue
+            job, started = self.running.pop(pid)
+            row = load_job(job['id'])
+            if row is None or row['created'] != job['created']:
+                # Purged, or failed and submitted again since
+                continue
+            if row['status'] == 'done':
+                STAGE_SECONDS.labels(f"jobs.{job['kind']}").observe(row['finished'] - started)
+            else:
+                finish_job(job['id'], 'failed', error="The job's process stopped before it finished")
+
+    def start_jobs(self):
+        dataset = _dataset
+        free = JOB_WORKERS - len(self.running)
+        if dataset is None or free <= 0:
+            return
+        for job in user_db().execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY created").fetchall():
+            if job['source'] == dataset.source and job['journal_offset'] > dataset.journal_offset:
+                continue
+            with user_db() as conn:
+                claimed = conn.execute("""UPDATE jobs SET status = 'running', pid = ?, version = ?
+                                          WHERE id = ? AND status = 'queued'""",
+                                       (self.pid, dataset.version, job['id'])).rowcount
+            if claimed:
+                self.start(dict(job), dataset if job['owner'] is None else dataset.for_owner(job['owner']))
+                free -= 1
+                if not free:
+                    break
+
+    def start(self, job, dataset):
+        with self.lock:
+            if self.stopped:
+                finish_job(job['id'], 'failed', error="The server stopped before the job ran")
+                return
+            try:
+                pid = os.fork()
+            except OSError as e:
+                finish_job(job['id'], 'failed', error=f"Could not start the job: {e}")
+                raise
+            if pid == 0:
+                try:
+                    init_job_process()
+                    run_job(job['id'], job['kind'], dataset, json.loads(job['params']))
+                except BaseException:
+                    app.logger.exception("Job %s (%s) failed", job['id'], job['kind'])
+                    os._exit(1)
+                os._exit(0)
+            self.running[pid] = (job, time.time())
+
+    def stop(self):
+        # The server is going away, and its jobs with it. Queued jobs stay
+        # queued for the next runner.
+        if os.getpid() != self.pid:
+            return
+        with self.lock:
+            self.stopped = True
+            for pid in self.running:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            for pid, (job, started) in self.running.items():
+                try:
+                    os.waitpid(pid, 0)
+                except ChildProcessError:
+                    pass
+                finish_job(job['id'], 'failed', error="The server stopped while the job ran")
+            self.running.clear()
+
+
+def start_job_runner():
+    # Called by the process that owns data reloads (create_app, or the
+    # gunicorn master in gunicorn.conf.py), which exits through sys.exit
+    global _job_runner
+    if _job_runner is None:
+        _job_runner = JobRunner()
+        threading.Thread(target=_job_runner.run, name='job-runner', daemon=True).start()
+        atexit.register(_job_runner.stop)
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def job_lost(job):
+    # Running jobs record the runner's process; queued ones wait for a runner
+    return job['status'] == 'running' and not process_alive(job['pid'])
+
+
+def purge_jobs():
+    # Drop expired jobs and their files, and the oldest files past
+    # JOB_MAX_ARTIFACTS, at most once a JOB_PURGE_INTERVAL per process
+    global _last_job_purge
+    now = time.time()
+    if now - _last_job_purge < JOB_PURGE_INTERVAL:
+        return
+    _last_job_purge = now
+    with user_db() as conn:
+        expired = conn.execute('''SELECT id, path FROM jobs WHERE finished < ? OR id IN (
+                                      SELECT id FROM jobs WHERE status = 'done'
+                                      ORDER BY finished DESC LIMIT -1 OFFSET ?)''',
+                               (now - JOB_RETENTION, JOB_MAX_ARTIFACTS)).fetchall()
+        conn.executemany('DELETE FROM jobs WHERE id = ?', [(job['id'],) for job in expired])
+    # Leftovers of job processes that died mid-write (<file>.<pid>.tmp) go too
+    stale = [job['path'] for job in expired if job['path']]
+    stale += [path for path in glob.glob(os.path.join(JOB_DIR, '*.tmp'))
+              if not process_alive(int(path.rsplit('.', 2)[1]))]
+    for path in stale:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def load_job(job_id):
+    row = user_db().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def submit_job(kind, dataset, params, filename):
+    # Returns the job, new or already known, or None when too many are waiting
+    job_id = hashlib.sha1(json.dumps([kind, dataset.version, dataset.owner, params]).encode()).hexdigest()[:16]
+    purge_jobs()
+    job = load_job(job_id)
+    if job is not None and (job['status'] == 'failed' or job_lost(job)):
+        # Failed or lost: run it again, unless another worker got there first
+        with user_db() as conn:
+            conn.execute('DELETE FROM jobs WHERE id = ? AND status = ? AND pid IS ?',
+                         (job_id, job['status'], job['pid']))
+        job = load_job(job_id)
+    if job is not None:
+        return job
+    conn = user_db()
+    if conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0] >= JOB_MAX_PENDING:
+        return None
+    with conn:
+        conn.execute('''INSERT OR IGNORE INTO jobs (id, kind, params, version, source, journal_offset, owner,
+                                                    filename, status, created)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'queued', ?)''',
+                     (job_id, kind, json.dumps(params), dataset.version, dataset.source, dataset.journal_offset,
+                      dataset.owner, filename, time.time()))
+    return load_job(job_id)
+
+
+def find_job(job_id):
+    # Only the owner a job was run for sees it
+    job = load_job(job_id)
+    if job is None or job['owner'] != current_dataset().owner:
+        return None
+    if job_lost(job):
+        finish_job(job_id, 'failed', error="The process running the job stopped")
+        job = load_job(job_id)
+    return job
+
+
+def job_json(job):
+    data = {key: job[key] for key in ('id', 'kind', 'status', 'version', 'error', 'size', 'created', 'finished')}
+    data['params'] = json.loads(job['params'])
+    data['progress'] = round(job['progress'], 3)
+    data['url'] = url_for('job_status', job_id=job['id'])
+    if job['status'] == 'done':
+        data['download'] = url_for('job_download', job_id=job['id'])
+    return data
+
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    if 'user' not in session:
+        return jsonify(error='login required'), 401
+    kind = request.args.get('kind')
+    if kind not in JOB_KINDS:
+        return jsonify(error=f"Unknown job kind {kind!r}; one of: {', '.join(JOB_KINDS)}"), 400
+    vehicle, route, start, end = report_params()
+    params = {'vehicle': vehicle, 'route': route,
+              'start': start.isoformat() if start is not None else None,
+              'end': end.isoformat() if end is not None else None}
+    job = submit_job(kind, current_dataset(), params, job_filename(kind))
+    if job is None:
+        return jsonify(error=f"At most {JOB_MAX_PENDING} jobs may wait at once"), 429
+    response = jsonify(job_json(job))
+    response.headers['Location'] = url_for('job_status', job_id=job['id'])
+    return response, 200 if job['status'] == 'done' else 202
+
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    if 'user' not in session:
+        return jsonify(error='login required'), 401
+    job = find_job(job_id)
+    if job is None:
+        return jsonify(error='No such job'), 404
+    return jsonify(job_json(job))
+
+
+@app.route('/api/jobs/<job_id>/download')
+def job_download(job_id):
+    if 'user' not in session:
+        return jsonify(error='login required'), 401
+    job = find_job(job_id)
+    if job is None:
+        return jsonify(error='No such job'), 404
+    if job['status'] != 'done':
+        return jsonify(job_json(job)), 409
+    if not os.path.exists(job['path']):
+        return jsonify(error='The job has expired; submit it again'), 410
+    return send_file(job['path'], mimetype=JOB_KINDS[job['kind']][1], as_attachment=True,
+                     download_name=job['filename'])
+
+
+# Application factory: loading happens here rather than at import, so a
+# pre-forking server (see gunicorn.conf.py) loads the dataset once in its
+# master and every worker shares those pages copy-on-write. The dataset loads
+# on a background thread so the server binds straight away; wait=True blocks
+# until it is ready instead, or raises if loading fails (scripts,
+# benchmarks). watch=True makes this
+# process the one that follows the sources and runs background jobs.
+def create_app(watch=True, wait=False):
+    init_user_db()
+    start_data_loader()
+    if wait:
+        wait_until_ready()
+    if watch:
+        start_data_watcher()
+        start_job_runner()
+    return app
+
+
+def reset_after_fork():
+    # A lock held by a master thread at fork time would stay locked forever
+    # in the child, so every worker starts with fresh ones
+    global _reload_lock, _session_cache_lock, _watcher_started, _publishing, _loader_started, _ready, _load_attempted
+    global live_feed
+    global _job_runner
+    _reload_lock = threading.Lock()
+    _session_cache_lock = threading.Lock()
+    result_cache.lock = threading.Lock()
+    _job_runner = None
+    _watcher_started = _publishing = False
+    live_feed = LiveFeed()
+    # A worker forked before the master finished loading stays unready until
+    # the master rolls the workers (gunicorn.conf.py)
+    _loader_started = False
+    _ready = threading.Event()
+    _load_attempted = threading.Condition()
+    if _dataset is not None:
+        _ready.set()
+        # Workers and job processes fork from a master whose other threads
+        # may be computing on the snapshot
+        for dataset in [_dataset, *_dataset.partitions.values()]:
+            dataset._derived_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', port=7860)
+    create_app().run(host='0.0.0.0', port=7860)
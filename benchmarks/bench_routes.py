@@ -0,0 +1,161 @@
+"""Latency percentiles, throughput and peak memory for every page route.
+
+Drives the app through an authenticated Flask test client against whatever
+FLEET_FILE / CLOSURE_FILE point at (see tools/generate_fleet_data.py), and
+saves the results as JSON so a later run can be compared against them.
+
+Run from the repository root:
+
+    FLEET_FILE=data/fleet_1000000.xlsx CLOSURE_FILE=data/closure_1000000.xlsx \\
+        python benchmarks/bench_routes.py --requests 50 --compare benchmarks/results/before.json
+
+--no-cache disables the result cache so every request pays for its compute.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def routes(dataset):
+    vehicle = dataset.vehicles[0] if dataset.vehicles else ''
+    paths = {
+        'dashboard': '/dashboard',
+        'dashboard_vehicle': f'/dashboard?vehicle={vehicle}',
+        'trip_generator': '/trip-generator',
+        'trip_closure': '/trip-closure',
+        'trip_auditor': '/trip-auditor',
+        'trip_ongoing': '/trip-ongoing',
+        'trip_stats': '/trip-stats',
+        'api_trip_stats': '/api/trip-stats',
+        'financial_dashboard': '/financial-dashboard',
+        'api_financial': '/api/financial',
+        'download_summary': '/download-summary',
+    }
+    if dataset.months:
+        paths['dashboard_month'] = f'/dashboard?month={max(dataset.months)}'
+    if dataset.routes:
+        paths['dashboard_route'] = f'/dashboard?route={dataset.routes[0]}'
+    return paths
+
+
+def measure(client, path, requests):
+    # First request separately (cold caches), then the steady state
+    tracemalloc.start()
+    started = time.perf_counter()
+    response = client.get(path)
+    response.get_data()
+    cold = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        t = time.perf_counter()
+        client.get(path).get_data()
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    ms = np.array(latencies) * 1e3
+    return {
+        'path': path, 'status': response.status_code, 'bytes': len(response.get_data()),
+        'cold_ms': round(cold * 1e3, 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p90_ms': round(float(np.percentile(ms, 90)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'mean_ms': round(float(ms.mean()), 3),
+        'throughput_rps': round(requests / elapsed, 1) if elapsed else None,
+        'peak_alloc_mb': round(peak / 2 ** 20, 2),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    print(f"\n{'route':<22}{'p50 before':>12}{'p50 now':>10}{'change':>9}{'p99 before':>12}{'p99 now':>10}{'change':>9}")
+    for name, now in results['routes'].items():
+        before = baseline['routes'].get(name)
+        if not before:
+            continue
+        cells = []
+        for key in ('p50_ms', 'p99_ms'):
+            change = (now[key] - before[key]) / before[key] * 100 if before[key] else 0
+            cells.append(f"{before[key]:>12.2f}{now[key]:>10.2f}{change:>+8.0f}%")
+        print(f"{name:<22}{''.join(cells)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20, help='timed requests per route after the first')
+    parser.add_argument('--only', nargs='*', help='route names to run')
+    parser.add_argument('--no-cache', action='store_true', help='disable the result cache')
+    parser.add_argument('--out', help='results file (default: benchmarks/results/<time>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    # Benchmark users and journals must not touch the real ones
+    scratch = tempfile.mkdtemp(prefix='fleet-bench-')
+    os.environ['USER_DB'] = os.path.join(scratch, 'users.db')
+    os.environ['INGEST_JOURNAL'] = os.path.join(scratch, 'ingest.jsonl')
+    os.environ['DATA_RELOAD_INTERVAL'] = '0'
+    if args.no_cache:
+        os.environ['RESULT_CACHE_SIZE'] = '0'
+    os.chdir(ROOT)
+    import app as fleet
+
+    started = time.perf_counter()
+    fleet.create_app(watch=False, wait=True)
+    load_seconds = time.perf_counter() - started
+    dataset = fleet._dataset
+
+    client = fleet.app.test_client()
+    client.post('/signup', data={'fullname': 'Bench', 'email': 'bench@example.com', 'password': 'bench'})
+    client.post('/login', data={'email': 'bench@example.com', 'password': 'bench'})
+
+    results = {
+        'commit': git_commit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(), 'fleet_file': fleet.fleet_file, 'closure_file': fleet.closure_file,
+        'trips': len(dataset.df), 'closures': len(dataset.closure_df), 'vehicles': len(dataset.vehicles),
+        'routes_in_data': len(dataset.routes), 'load_seconds': round(load_seconds, 3),
+        'requests': args.requests, 'result_cache': not args.no_cache, 'routes': {},
+    }
+    print(f"{results['trips']} trips, {results['closures']} closures, loaded in {load_seconds:.2f}s")
+    print(f"{'route':<22}{'status':>7}{'cold ms':>10}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'req/s':>9}{'peak MB':>9}")
+    for name, path in routes(dataset).items():
+        if args.only and name not in args.only:
+            continue
+        r = measure(client, path, args.requests)
+        results['routes'][name] = r
+        print(f"{name:<22}{r['status']:>7}{r['cold_ms']:>10.1f}{r['p50_ms']:>9.2f}{r['p90_ms']:>9.2f}"
+              f"{r['p99_ms']:>9.2f}{r['throughput_rps'] or 0:>9.1f}{r['peak_alloc_mb']:>9.2f}")
+    results['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    print(f"max RSS {results['max_rss_mb']} MB")
+
+    out = args.out or os.path.join(ROOT, 'benchmarks', 'results', time.strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"saved {out}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Per-request template render cost: compile-per-request vs precompiled.
+
+Run from the repository root:
+
+    python benchmarks/bench_templates.py [iterations]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import render_template, render_template_string  # noqa: E402
+
+import app as fleet  # noqa: E402
+
+fleet.create_app(watch=False, wait=True)
+
+
+def contexts(dataset):
+    m = fleet.dashboard_metrics(dataset, None, None)
+    columns = ['Trip ID', 'Vehicle ID', 'Trip Status']
+    rows = list(dataset.df[columns].head(fleet.TABLE_PAGE_SIZE).itertuples(index=False, name=None))
+    return {
+        'signup': {},
+        'login': {},
+        'dashboard': dict(m, vehicles=dataset.vehicles, routes=dataset.routes,
+                          selected_vehicle=None, selected_route=None),
+        'table_page': dict(title='Trip Generator', columns=columns, rows=rows, total=len(rows), q='',
+                           sort='', size=fleet.TABLE_PAGE_SIZE, first=1, last=len(rows), prev_url=None,
+                           next_url=None, json_url='/trip-generator?format=json',
+                           sort_urls={col: '#' for col in columns}),
+        'trip_stats': {},
+        'financial_dashboard': {},
+    }
+
+
+def main(iterations=200):
+    with fleet.app.test_request_context('/dashboard'):
+        ctx = contexts(fleet.current_dataset())
+        print(f"{'template':<22}{'compile/request':>18}{'precompiled':>14}{'speedup':>10}")
+        for name, context in ctx.items():
+            before = timeit.timeit(lambda: render_template_string(fleet.TEMPLATES[name], **context),
+                                   number=iterations) / iterations
+            after = timeit.timeit(lambda: render_template(f'{name}.html', **context),
+                                  number=iterations) / iterations
+            print(f"{name:<22}{before * 1e6:>15.1f} us{after * 1e6:>11.1f} us{before / after:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,85 @@
+# Production serving: gunicorn -c gunicorn.conf.py
+#
+# The app is preloaded, so the master loads the dataset once and every worker
+# is forked from it, sharing the frames copy-on-write. Worker memory stays
+# roughly flat as WEB_CONCURRENCY grows. The master also owns data reloads:
+# when the workbooks change it loads the new snapshot and rolls the workers
+# (SIGHUP), so they fork from the new snapshot too. Ingested batches do not
+# roll anything: each worker follows the journal and merges new batches
+# in-process, keeping its live streams, caches and jobs (the merged frames
+# are private to the worker until the next roll).
+# Loading runs in the background, so the server binds at once; workers forked
+# before it finishes answer 503 on data routes and are rolled once it does.
+# Background jobs run in processes the master forks too (see JobRunner).
+import gc
+import multiprocessing
+import os
+import shutil
+import signal
+import tempfile
+import threading
+
+# Prometheus samples from every process are aggregated through this
+# directory. The config is re-read on SIGHUP, so it is only emptied the first
+# time this master loads it.
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'fleet_metrics'))
+if os.environ.get('FLEET_METRICS_MASTER') != str(os.getpid()):
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.environ['FLEET_METRICS_MASTER'] = str(os.getpid())
+os.makedirs(metrics_dir, exist_ok=True)
+
+wsgi_app = 'app:create_app(watch=False)'
+preload_app = True
+bind = os.environ.get('BIND', '0.0.0.0:7860')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+# Each open live stream (/api/stream) holds a thread while it waits for the
+# next event, so workers keep enough for the control room's screens
+threads = int(os.environ.get('GUNICORN_THREADS', '32'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = 30
+accesslog = '-'
+
+
+def when_ready(server):
+    import app
+
+    def roll_workers():
+        os.kill(os.getpid(), signal.SIGHUP)
+
+    def roll_when_loaded():
+        app.wait_until_ready(retrying=True)
+        roll_workers()
+
+    if not app.wait_until_ready(0, retrying=True):
+        threading.Thread(target=roll_when_loaded, name='roll-when-loaded', daemon=True).start()
+    app.start_data_watcher(on_reload=roll_workers)
+    app.start_job_runner()
+
+
+def post_worker_init(worker):
+    import app
+
+    # Live streams never finish on their own: end them on a graceful stop
+    # (including the roll onto new workbooks) rather than wait out graceful_timeout
+    handle_exit = worker.handle_exit
+
+    def close_streams(sig, frame):
+        app.live_feed.close()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, close_streams)
+    app.start_data_watcher(sources=False)
+
+
+def pre_fork(server, worker):
+    # Objects that survive into the children move to the permanent
+    # generation, so garbage collection in a worker does not write to (and
+    # un-share) the pages holding them
+    gc.freeze()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,139 @@
+"""Ingested batches merged into a snapshot match a snapshot built from scratch.
+
+Dataset.extended() merges a batch into the cube, rollups, row and cube
+positions and month partitions instead of rebuilding them; every one of
+those must equal what loading the combined rows gives.
+
+Run from the repository root:
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app  # noqa: E402
+
+STATUSES = ['Pending Closure', 'Completed', 'Under Audit']
+
+
+def trips(ids, vehicles, seed, start='2024-10-01', days=150):
+    rng = np.random.default_rng(seed)
+    n = len(ids)
+    freight = rng.integers(1000, 50000, n).astype('float64')
+    expense = rng.integers(500, 40000, n).astype('float64')
+    return pd.DataFrame({
+        'Trip ID': ids,
+        'Trip Date': pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days, n), unit='D'),
+        'Vehicle ID': rng.choice(vehicles, n),
+        'Route': rng.choice(['Pune-Delhi', 'Delhi-Agra', 'Agra-Pune'], n),
+        'Trip Status': rng.choice(STATUSES, n),
+        'POD Status': rng.choice(['Yes', 'No'], n),
+        'Freight Amount': freight,
+        'Total Trip Expense': expense,
+        'Net Profit': freight - expense,
+        'Actual Distance (KM)': rng.integers(10, 900, n).astype('float64'),
+    })
+
+
+def closures(frame):
+    return frame.drop(columns=['Route', 'POD Status'])
+
+
+def load(fleet, closure):
+    # What load_dataset() does with the workbook frames
+    return app.Dataset('v', app.clean_frame(fleet.copy()), app.clean_frame(closure.copy()))
+
+
+def ingest(dataset, fleet_rows, closure_rows):
+    # What apply_journal() does with journalled rows
+    trips_batch = app.validate_batch(fleet_rows.astype(object), dataset.df, dataset.df.columns)
+    closure_batch = app.validate_batch(closure_rows.astype(object), dataset.closure_df, dataset.df.columns)
+    return dataset.extended('w', 1, trips_batch, closure_batch)
+
+
+def plain(frame):
+    # Categoricals as their values, so differently coded frames compare equal
+    frame = frame.reset_index(drop=True)
+    return frame.astype({c: object for c in frame.columns if isinstance(frame[c].dtype, pd.CategoricalDtype)})
+
+
+def assert_positions_equal(merged, built):
+    assert set(merged) == set(built)
+    for key, rows in built.items():
+        np.testing.assert_array_equal(np.sort(merged[key]), rows, err_msg=str(key))
+
+
+def scenarios():
+    base = trips([f'T{i}' for i in range(400)], [f'VH{i:03d}' for i in range(12)], seed=1)
+    # Undated workbook rows sort last and stay out of every bucket
+    base.loc[[5, 17], 'Trip Date'] = pd.NaT
+    batch = trips([f'N{i}' for i in range(30)], [f'VH{i:03d}' for i in range(10, 15)], seed=2,
+                  start='2025-02-15', days=60)
+    # A Trip ID already in the workbooks, and one repeated within the batch
+    batch.loc[0, 'Trip ID'] = 'T7'
+    batch.loc[1, 'Trip ID'] = batch.loc[2, 'Trip ID']
+    # A cell already in the cube: same keys and day as a workbook row
+    batch.loc[3, ['Vehicle ID', 'Route', 'Trip Status', 'POD Status', 'Trip Date']] = \
+        base.loc[0, ['Vehicle ID', 'Route', 'Trip Status', 'POD Status', 'Trip Date']].to_numpy()
+    yield 'later batch', base, batch
+    # Rows before the first workbook date, sharing days with each other
+    early = trips([f'E{i}' for i in range(12)], ['VH001', 'VH002'], seed=3, start='2024-08-01', days=3)
+    early.loc[0, 'Trip ID'] = 'T1'
+    yield 'earlier batch', base, early
+
+
+@pytest.mark.parametrize('name,base,batch', list(scenarios()), ids=lambda v: v if isinstance(v, str) else '')
+def test_ingested_batch_matches_full_build(name, base, batch):
+    merged = ingest(load(base, closures(base)), batch, closures(batch))
+    built = load(pd.concat([base, batch], ignore_index=True), closures(pd.concat([base, batch], ignore_index=True)))
+
+    pd.testing.assert_frame_equal(plain(merged.df), plain(built.df), check_dtype=False)
+    pd.testing.assert_frame_equal(plain(merged.cube), plain(built.cube), check_dtype=False)
+    pd.testing.assert_frame_equal(plain(merged.closure_df), plain(built.closure_df), check_dtype=False)
+    for ours, theirs in ((merged.rollups, built.rollups), (merged.closure_rollups, built.closure_rollups)):
+        pd.testing.assert_series_equal(ours['total'], theirs['total'], check_dtype=False)
+        for bucket in ('day', 'week', 'month', 'year'):
+            pd.testing.assert_frame_equal(ours[bucket], theirs[bucket], check_dtype=False)
+
+    assert merged.months == built.months
+    assert merged.closure_months == built.closure_months
+    assert (merged.first_date, merged.last_date) == (built.first_date, built.last_date)
+    assert merged.vehicles == built.vehicles
+    assert merged.routes == built.routes
+    for attr in ('cube_vehicle_positions', 'cube_route_positions', 'status_positions', 'vehicle_positions',
+                 'route_positions'):
+        assert_positions_equal(getattr(merged, attr), getattr(built, attr))
+
+    assert merged.trip_ids.equals(built.trip_ids)
+    assert merged.closure_trip_ids.equals(built.closure_trip_ids)
+    duplicate = batch.loc[0, 'Trip ID']
+    fleet, closure = merged.trip(duplicate)
+    assert len(fleet) == len(built.trip(duplicate)[0]) == 2
+    assert len(closure) == 2
+
+
+@pytest.mark.parametrize('compact', [True, False], ids=['categorical keys', 'string keys'])
+def test_merge_cube_adds_to_existing_cells_and_inserts_new_ones(compact):
+    frame = trips([f'T{i}' for i in range(300)], ['VH001', 'VH002', 'VH003'], seed=5, days=20)
+    frame.loc[::7, 'Route'] = None
+    frame.loc[::11, 'Trip Date'] = pd.NaT
+    frame = app.index_by_date(frame)
+    if compact:
+        frame = app.compact_frame(frame)
+    # Every other row: most of the second half's cells are already in the first's cube
+    first, second = frame.iloc[::2], frame.iloc[1::2]
+    cube, old_at, added, added_at = app.merge_cube(app.build_cube(first), app.build_cube(second))
+    pd.testing.assert_frame_equal(plain(cube), plain(app.build_cube(frame)), check_dtype=False)
+    assert len(added) < len(app.build_cube(second))
+    # Old and inserted cells sit where merge_cube says they do
+    pd.testing.assert_frame_equal(plain(cube.take(added_at)), plain(added), check_dtype=False)
+    old = app.build_cube(first)
+    pd.testing.assert_frame_equal(plain(cube.take(old_at)[['Vehicle ID', 'Route', 'Date']]),
+                                  plain(old[['Vehicle ID', 'Route', 'Date']]), check_dtype=False)
@@ -0,0 +1,83 @@
+"""Build the static assets the pages load: the purged stylesheet and Chart.js.
+
+Compiles assets/app.css with the Tailwind CLI (only the utilities app.py's
+templates use are kept), copies the vendored Chart.js, and writes each under a
+content-hashed name in static/ together with gzip and brotli variants. The
+app resolves the hashed names through static/manifest.json, so the files can
+be cached forever. Rerun after changing classes in the templates and commit
+the output; the app itself needs neither Tailwind nor a network connection.
+
+Needs the Tailwind CLI and brotli (pip install tailwindcss-bin brotli). Run
+from the repository root:
+
+    python tools/build_assets.py
+"""
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import brotli
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ASSETS_DIR = os.path.join(ROOT, 'assets')
+STATIC_DIR = os.path.join(ROOT, 'static')
+
+
+def build_css(tailwind):
+    result = subprocess.run([tailwind, '--input', os.path.join(ASSETS_DIR, 'app.css'), '--minify'],
+                            cwd=ROOT, capture_output=True)
+    if result.returncode:
+        sys.exit(result.stderr.decode())
+    return result.stdout
+
+
+def read_vendor(name):
+    with open(os.path.join(ASSETS_DIR, 'vendor', name), 'rb') as f:
+        return f.read()
+
+
+def write_asset(name, content):
+    # app.css -> app.<hash>.css, plus .gz and .br beside it; older builds of
+    # the same asset are removed
+    stem, ext = os.path.splitext(name)
+    hashed = f"{stem}.{hashlib.sha256(content).hexdigest()[:12]}{ext}"
+    for old in glob.glob(os.path.join(STATIC_DIR, f"{stem}.*{ext}*")):
+        if not os.path.basename(old).startswith(hashed):
+            os.remove(old)
+    path = os.path.join(STATIC_DIR, hashed)
+    with open(path, 'wb') as f:
+        f.write(content)
+    # mtime=0 keeps the gzip output identical between builds
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(content, compresslevel=9, mtime=0))
+    with open(path + '.br', 'wb') as f:
+        f.write(brotli.compress(content, quality=11))
+    print(f"{hashed}: {len(content)} bytes, gzip {os.path.getsize(path + '.gz')}, "
+          f"brotli {os.path.getsize(path + '.br')}")
+    return hashed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tailwind', default=shutil.which('tailwindcss') or 'tailwindcss',
+                        help='Tailwind CLI executable')
+    args = parser.parse_args()
+
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    manifest = {
+        'app.css': write_asset('app.css', build_css(args.tailwind)),
+        'chart.js': write_asset('chart.js', read_vendor('chart.umd.min.js')),
+    }
+    with open(os.path.join(STATIC_DIR, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""Synthetic fleet and trip closure data with the workbook columns.
+
+Writes a closure file of --closure-rows trips and a fleet file holding the
+first --rows of them, as the bundled workbooks do. Excel stops at 1,048,575
+data rows, so larger sizes default to Parquet; point the app at the output
+with FLEET_FILE / CLOSURE_FILE.
+
+Run from the repository root:
+
+    python tools/generate_fleet_data.py --rows 10000 --vehicles 200 --routes 40
+    python tools/generate_fleet_data.py --rows 10000000 --format parquet --out-dir /data
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+
+EXCEL_MAX_ROWS = 1048575
+CHUNK_ROWS = 500000
+
+CITIES = ['Ahmedabad', 'Bangalore', 'Chennai', 'Delhi', 'Hyderabad', 'Jaipur', 'Kolkata', 'Mumbai',
+          'Pune', 'Surat', 'Lucknow', 'Nagpur', 'Indore', 'Kochi', 'Vizag', 'Bhopal']
+DELAY_REASONS = [None, 'Breakdown', 'Route Issue', 'Traffic', 'Weather']
+PAYMENT_MODES = ['Bank Transfer', 'Cash', 'UPI']
+VEHICLE_TYPES = ['Container', 'Flatbed', 'Reefer', 'Tanker', 'Trailer']
+TRIP_STATUSES = ['Completed', 'Pending Closure', 'Under Audit']
+EXPENSES = ['Toll Charges', 'Food Expense', 'Lodging Expense', 'Miscellaneous Expense',
+            'Maintenance Cost', 'Loading Charges', 'Unloading Charges', 'Penalty/Fine']
+
+
+def route_table(routes, rng):
+    pairs = [(a, b) for a in CITIES for b in CITIES if a != b]
+    picked = rng.choice(len(pairs), size=min(max(routes, 1), len(pairs)), replace=False)
+    return [pairs[i] for i in picked]
+
+
+def trips(start, count, args, routes, rng):
+    # One chunk of trips; start is the first trip's sequence number
+    days = (pd.Timestamp(args.end) - pd.Timestamp(args.start)).days + 1
+    trip_date = pd.Timestamp(args.start) + pd.to_timedelta(rng.integers(0, days, count), unit='D')
+    route = rng.integers(0, len(routes), count)
+    planned = rng.integers(300, 1200, count)
+    actual = np.maximum((planned * rng.uniform(0.88, 1.08, count)).round(), 1).astype('int64')
+    fuel_quantity = (actual / rng.uniform(3.5, 5.0, count)).round(2)
+    fuel_rate = rng.uniform(85, 105, count).round(2)
+    fuel_cost = (fuel_quantity * fuel_rate).round(2)
+    expenses = {
+        'Toll Charges': rng.integers(500, 1501, count),
+        'Food Expense': rng.integers(200, 800, count),
+        'Lodging Expense': rng.integers(500, 1500, count),
+        'Miscellaneous Expense': rng.integers(100, 501, count),
+        'Maintenance Cost': rng.integers(0, 2000, count),
+        'Loading Charges': rng.integers(300, 700, count),
+        'Unloading Charges': rng.integers(300, 701, count),
+        'Penalty/Fine': rng.choice([0, 100, 200], count),
+    }
+    total_expense = (fuel_cost + sum(expenses.values())).round(2)
+    net_profit = rng.integers(2000, 10000, count).astype('float64')
+    frame = {
+        'Trip ID': [f"T{n:08d}" for n in range(start, start + count)],
+        'Trip Date': trip_date,
+        'Vehicle ID': [f"VH{n:04d}" for n in rng.integers(1, args.vehicles + 1, count)],
+        'Driver ID': [f"DR{n:04d}" for n in rng.integers(1, args.drivers + 1, count)],
+        'Planned Distance (KM)': planned,
+        'Actual Distance (KM)': actual,
+        'Actual Delivery Date': trip_date + pd.to_timedelta(rng.integers(1, 6, count), unit='D'),
+        'Trip Delay Reason': rng.choice(np.array(DELAY_REASONS, dtype=object), count),
+        'Advance Given': rng.integers(2000, 8000, count),
+        'Fuel Quantity (L)': fuel_quantity,
+        'Fuel Rate': fuel_rate,
+        'Fuel Cost': fuel_cost,
+        **expenses,
+        'Total Trip Expense': total_expense,
+        'Freight Amount': (total_expense + net_profit).round(2),
+        'Incentives': rng.choice([0, 500, 1000], count),
+        'Net Profit': net_profit,
+        'Payment Mode': rng.choice(PAYMENT_MODES, count),
+        'POD Status': rng.choice(['No', 'Yes'], count),
+        'Origin': [routes[r][0] for r in route],
+        'Destination': [routes[r][1] for r in route],
+        'Vehicle Type': rng.choice(VEHICLE_TYPES, count),
+        'Trip Status': rng.choice(TRIP_STATUSES, count),
+    }
+    if args.routes:
+        frame['Route'] = [f"{routes[r][0]}-{routes[r][1]}" for r in route]
+    return pd.DataFrame(frame)
+
+
+class Writer:
+    # Appends chunks to one output file in the chosen format
+    def __init__(self, path, fmt):
+        self.path, self.fmt = path, fmt
+        self.parquet = None
+        self.header = True
+        if fmt == 'xlsx':
+            self.workbook = Workbook(write_only=True)
+            self.sheet = self.workbook.create_sheet('Sheet1')
+
+    def write(self, chunk):
+        if self.fmt == 'parquet':
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if self.parquet is None:
+                self.parquet = pq.ParquetWriter(self.path, table.schema)
+            self.parquet.write_table(table)
+        elif self.fmt == 'csv':
+            chunk.to_csv(self.path, mode='w' if self.header else 'a', header=self.header, index=False)
+        else:
+            if self.header:
+                self.sheet.append(list(chunk.columns))
+            for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+                self.sheet.append(row)
+        self.header = False
+
+    def close(self):
+        if self.fmt == 'parquet' and self.parquet is not None:
+            self.parquet.close()
+        elif self.fmt == 'xlsx':
+            self.workbook.save(self.path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000, help='fleet (trip) rows')
+    parser.add_argument('--closure-rows', type=int, help='closure rows, at least --rows (default: --rows)')
+    parser.add_argument('--vehicles', type=int, default=50)
+    parser.add_argument('--drivers', type=int, default=100)
+    parser.add_argument('--routes', type=int, default=0,
+                        help="distinct origin-destination pairs; >0 also writes a 'Route' column")
+    parser.add_argument('--start', default='2024-10-01')
+    parser.add_argument('--end', default='2025-03-31')
+    parser.add_argument('--format', choices=['xlsx', 'csv', 'parquet'],
+                        help='default: xlsx up to the Excel row limit, parquet beyond it')
+    parser.add_argument('--out-dir', default='.')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    closure_rows = max(args.closure_rows or args.rows, args.rows)
+    fmt = args.format or ('xlsx' if closure_rows <= EXCEL_MAX_ROWS else 'parquet')
+    if fmt == 'xlsx' and closure_rows > EXCEL_MAX_ROWS:
+        parser.error(f"xlsx holds at most {EXCEL_MAX_ROWS} rows; use --format csv or parquet")
+
+    rng = np.random.default_rng(args.seed)
+    routes = route_table(args.routes or len(CITIES), rng)
+    os.makedirs(args.out_dir, exist_ok=True)
+    fleet_path = os.path.join(args.out_dir, f"fleet_{args.rows}.{fmt}")
+    closure_path = os.path.join(args.out_dir, f"closure_{closure_rows}.{fmt}")
+    fleet, closure = Writer(fleet_path, fmt), Writer(closure_path, fmt)
+    for start in range(0, closure_rows, CHUNK_ROWS):
+        chunk = trips(start, min(CHUNK_ROWS, closure_rows - start), args, routes, rng)
+        closure.write(chunk)
+        if start < args.rows:
+            fleet.write(chunk.iloc[:args.rows - start])
+        print(f"{start + len(chunk)}/{closure_rows} rows", flush=True)
+    fleet.close()
+    closure.close()
+    print(f"FLEET_FILE={fleet_path} CLOSURE_FILE={closure_path}")
+
+
+if __name__ == '__main__':
+    main()